@@ -1,53 +1,446 @@
 import json
 import os
-import boto3
-from flask import Flask, request, jsonify
+import threading
+from flask import (Blueprint, Flask, Response, current_app, g, request, jsonify,
+                   stream_with_context)
+from flask import json as flask_json
 from flask_cors import CORS
-from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
 from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required, JWTManager
+from werkzeug.local import LocalProxy
+import click
+import math
+import numpy as np
+import sqlalchemy
 from zipcode import Distance
+from pubsub import make_broker
+from decks import DeckCache
+from cache import LRUCache
+from interests import InterestIndex, tokenize
+from search import create_search_index, search_users
+import time
+from pagination import decode_cursor, encode_cursor, get_limit, nearest_page, MAX_PAGE_SIZE
 import uuid
+from variants import VariantPipeline
+from storage import (DeletionWorker, drain_deletions, get_object_info,
+                     is_photo_key, make_s3_client, new_photo_key,
+                     object_keys_for_user, presign_upload, reconcile_storage)
+from datetime import timedelta
+
+from passwords import hasher
+import metrics
+import replicas
+from replicas import mark_write, may_fill_cache, may_read_cache, use_replica
+from models import (db, connect_db, User, Message, Match, Images, Conversation,
+                    StorageDeletion)
 
-from models import db, connect_db, User, Message, Match, Images
+from werkzeug.utils import secure_filename
 
-app = Flask(__name__)
+DEFAULT_CONFIG = dict(
+    SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    SQLALCHEMY_ECHO=False,
+    DEBUG_TB_INTERCEPT_REDIRECTS=True,
+    # Set S3_ENDPOINT_URL to use a local S3 stand-in (MinIO, moto server).
+    S3_ENDPOINT_URL=None,
+    S3_REGION=None,
+    PHOTO_UPLOAD_EXPIRES=900,
+    MAX_PHOTO_BYTES=10 * 1024 * 1024,
+    IMAGE_VARIANT_WORKERS=2,
+    IMAGE_VARIANTS_WEBP=False,
+    # Seconds between drains of the S3 deletion queue by a background thread
+    # in this process; None to drain with `flask drain-deletions` from cron.
+    STORAGE_DELETION_INTERVAL=None,
+    # Set to a redis:// url to deliver message events across workers.
+    PUBSUB_URL=None,
+    STREAM_KEEPALIVE=15,
+    DECK_CACHE_SIZE=10000,
+    DECK_CACHE_TTL=60,
+    # Serialized profiles (User.to_dict()) kept per worker; PATCH/DELETE/photo
+    # changes invalidate locally, the TTL bounds staleness across workers.
+    PROFILE_CACHE_SIZE=10000,
+    PROFILE_CACHE_TTL=60,
+    # How long a worker trusts its interest index before reloading it from
+    # the database, so edits handled by other workers show up.
+    INTEREST_INDEX_TTL=300,
+    # bcrypt cost factor, and processes hashing passwords per server worker
+    # (None: one per core, 0 hashes on the request thread).
+    BCRYPT_LOG_ROUNDS=12,
+    PASSWORD_HASH_WORKERS=None,
+    # Log requests slower than this many milliseconds, with their SQL.
+    SLOW_REQUEST_MS=None,
+    # Seconds a user's reads stay on the primary after they write, when
+    # REPLICA_DATABASE_URL is set.
+    REPLICA_STICKY_SECONDS=10,
+    # redis:// url where workers share who wrote recently (default: PUBSUB_URL).
+    REPLICA_STICKY_URL=None,
+)
 
-CORS(app)
+# Connection pool settings: env var -> (create_engine option, parser).
+# pool_size/max_overflow/pool_timeout only apply to pooled (postgres) engines.
+POOL_OPTIONS = {
+    'DB_POOL_SIZE': ('pool_size', int),
+    'DB_MAX_OVERFLOW': ('max_overflow', int),
+    'DB_POOL_TIMEOUT': ('pool_timeout', int),
+    'DB_POOL_RECYCLE': ('pool_recycle', int),
+    'DB_POOL_PRE_PING': ('pool_pre_ping', lambda value: value == 'true'),
+}
+
+MAX_SWIPE_BATCH = 500
+
+
+def config_from_env(environ=os.environ):
+    """Return the app config set by environment variables."""
+
+    config = dict(
+        # Get DB_URI from environ variable (useful for production/testing).
+        SQLALCHEMY_DATABASE_URI=environ['DATABASE_URL'].replace("postgres://", "postgresql://"),
+        SECRET_KEY=environ['SECRET_KEY'],
+        S3_KEY=environ['AWS_ACCESS_KEY_ID'],
+        S3_SECRET=environ['AWS_SECRET_ACCESS_KEY'],
+        S3_BUCKET=environ['BUCKET_NAME'],
+        S3_ENDPOINT_URL=environ.get('S3_ENDPOINT_URL'),
+        S3_REGION=environ.get('S3_REGION'),
+        PUBSUB_URL=environ.get('PUBSUB_URL'),
+        REPLICA_STICKY_URL=environ.get('REPLICA_STICKY_URL'),
+        IMAGE_VARIANTS_WEBP=environ.get('IMAGE_VARIANTS_WEBP') == 'true',
+    )
+
+    for name in ('IMAGE_VARIANT_WORKERS', 'STORAGE_DELETION_INTERVAL',
+                 'DECK_CACHE_SIZE', 'DECK_CACHE_TTL', 'PROFILE_CACHE_SIZE',
+                 'PROFILE_CACHE_TTL', 'INTEREST_INDEX_TTL', 'BCRYPT_LOG_ROUNDS',
+                 'PASSWORD_HASH_WORKERS', 'SLOW_REQUEST_MS', 'REPLICA_STICKY_SECONDS'):
+        if name in environ:
+            config[name] = int(environ[name])
+
+    # Options for the primary and replica engines alike.
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        option: parse(environ[name])
+        for name, (option, parse) in POOL_OPTIONS.items() if name in environ
+    }
+
+    # A read-only copy of the database for @use_replica views.
+    if environ.get('REPLICA_DATABASE_URL'):
+        config['SQLALCHEMY_BINDS'] = {
+            replicas.REPLICA_BIND:
+                environ['REPLICA_DATABASE_URL'].replace("postgres://", "postgresql://"),
+        }
+
+    return config
+
+
+def create_app(test_config=None):
+    """Create the app, configured from the environment or `test_config`.
+
+    Nothing here touches the database, S3 or the zipcode table; those are
+    set up on first use. Create the schema with `flask init-db`.
+    """
+
+    app = Flask(__name__)
+    app.config.from_mapping(DEFAULT_CONFIG)
+    app.config.from_mapping(config_from_env() if test_config is None else test_config)
+
+    if 'S3_LOCATION' not in app.config:
+        app.config['S3_LOCATION'] = (
+            '{}/{}/'.format(app.config['S3_ENDPOINT_URL'].rstrip('/'), app.config['S3_BUCKET'])
+            if app.config['S3_ENDPOINT_URL']
+            else 'http://{}.s3.amazonaws.com/'.format(app.config['S3_BUCKET']))
+
+    CORS(app)
+    # from flask_debugtoolbar import DebugToolbarExtension
+    # toolbar = DebugToolbarExtension(app)
+    JWTManager(app)
+    connect_db(app)
+    metrics.init_app(app)
+    replicas.init_app(app)
+
+    hasher.configure(app.config['BCRYPT_LOG_ROUNDS'], app.config['PASSWORD_HASH_WORKERS'])
+
+    app.extensions['friender'] = dict(
+        decks=DeckCache(app.config['DECK_CACHE_SIZE'], app.config['DECK_CACHE_TTL']),
+        profiles=LRUCache(app.config['PROFILE_CACHE_SIZE'], app.config['PROFILE_CACHE_TTL']),
+        interest_index=InterestIndex(),
+        variant_pipeline=VariantPipeline(app.config['IMAGE_VARIANT_WORKERS']),
+        deletion_worker=DeletionWorker(app.config['STORAGE_DELETION_INTERVAL'] or 30),
+    )
+
+    app.register_blueprint(api)
+
+    if app.config['STORAGE_DELETION_INTERVAL']:
+        with app.app_context():
+            deletion_worker.start(app, get_s3())
+
+    return app
+
+
+resources_lock = threading.Lock()
+
+
+def get_resource(name, factory=None):
+    """Return the current app's `name` resource, creating it with
+    factory(app) the first time it is asked for."""
+
+    resources = current_app.extensions['friender']
+
+    if name not in resources and factory is not None:
+        with resources_lock:
+            if name not in resources:
+                resources[name] = factory(current_app._get_current_object())
+
+    return resources[name]
+
+
+def get_s3():
+    """Return the app's S3 client, created on first use."""
+
+    return get_resource(
+        's3', lambda app: metrics.instrument_s3(make_s3_client(app.config)))
+
+
+def get_broker():
+    """Return the app's message broker, connected on first use."""
+
+    return get_resource('broker', lambda app: make_broker(app.config['PUBSUB_URL']))
 
-from werkzeug.utils import secure_filename
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ['DATABASE_URL'].replace("postgres://", "postgresql://"))
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 
-app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
-app.config['S3_KEY'] = os.environ['AWS_ACCESS_KEY_ID']
-app.config['S3_SECRET'] = os.environ['AWS_SECRET_ACCESS_KEY']
-app.config['S3_BUCKET'] = os.environ['BUCKET_NAME']
-app.config['S3_LOCATION'] = 'http://{}.s3.amazonaws.com/'.format(app.config['S3_BUCKET'])
+def submit_variants(image_id):
+    """Render an image's variants in the background; returns a Future."""
 
+    return variant_pipeline.submit(current_app._get_current_object(), get_s3(), image_id)
 
-s3 = boto3.client('s3',
-                    aws_access_key_id=app.config['S3_KEY'],
-                    aws_secret_access_key= app.config['S3_SECRET'],
-                     )
 
-# toolbar = DebugToolbarExtension(app)
+decks = LocalProxy(lambda: get_resource('decks'))
+profiles = LocalProxy(lambda: get_resource('profiles'))
+interest_index = LocalProxy(lambda: get_resource('interest_index'))
+variant_pipeline = LocalProxy(lambda: get_resource('variant_pipeline'))
+deletion_worker = LocalProxy(lambda: get_resource('deletion_worker'))
+broker = LocalProxy(get_broker)
 
-jwt = JWTManager(app)
-connect_db(app)
-db.create_all()
+# Routes and cli commands; cli_group=None keeps them as top-level `flask` commands.
+api = Blueprint('api', __name__, cli_group=None)
 
 #############################################################################
 
+def add_location_columns():
+    """Add users.latitude/longitude to a users table that predates them.
+    Returns the names of the columns added."""
+
+    columns = {column["name"] for column in sqlalchemy.inspect(db.engine).get_columns("users")}
+    added = [name for name in ("latitude", "longitude") if name not in columns]
+    for name in added:
+        db.session.execute(sqlalchemy.text(f"ALTER TABLE users ADD COLUMN {name} FLOAT"))
+    db.session.commit()
+
+    return added
+
+
+@api.cli.command("init-db")
+def init_db():
+    """Create missing tables, columns and indexes.
+
+    To upgrade an existing database run, in order: init-db,
+    backfill-locations (geocodes existing users), create-search-index and
+    rebuild-conversations (fills the inbox from existing messages). New
+    users tables get the search index from init-db."""
+
+    db.create_all()
+    added = add_location_columns()
+    # superseded by ix_messages_conversation_id, which also covers id
+    db.session.execute(sqlalchemy.text("DROP INDEX IF EXISTS ix_messages_conversation"))
+    db.session.commit()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    click.echo("database initialized")
+
+    if added:
+        click.echo("added users." + ", users.".join(added)
+                   + "; run backfill-locations to geocode existing users")
+
+@api.cli.command("backfill-locations")
+@click.option("--batch-size", default=1000, help="Users geocoded per commit.")
+def backfill_locations(batch_size):
+    """Add users.latitude/longitude if missing and geocode existing users."""
+
+    add_location_columns()
+    for index in User.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+    last_username = ""
+    total = 0
+
+    while True:
+        users = (User.query
+                 .filter(User.latitude.is_(None), User.username > last_username)
+                 .order_by(User.username)
+                 .limit(batch_size)
+                 .all())
+        if not users:
+            break
+
+        lats, lons = Distance.get_coordinates([user.location for user in users])
+        for user, lat, lon in zip(users, lats, lons):
+            if not math.isnan(lat):
+                user.latitude = float(lat)
+                user.longitude = float(lon)
+                total += 1
+
+        db.session.commit()
+        last_username = users[-1].username
+
+    click.echo(f"geocoded {total} users")
+
+
+@api.cli.command("rebuild-conversations")
+def rebuild_conversations():
+    """Rebuild the conversations inbox table from messages.
+    Unread counts start at zero."""
+
+    count = Conversation.rebuild()
+    db.session.commit()
+
+    click.echo(f"rebuilt {count} conversations")
+
+
+@api.cli.command("create-search-index")
+def create_search_index_command():
+    """Create the full-text search index on an existing users table."""
+
+    create_search_index()
+    click.echo("search index created")
+
+
+@api.cli.command("drain-deletions")
+def drain_deletions_command():
+    """Delete every S3 object queued for deletion."""
+
+    deleted = drain_deletions(get_s3(), current_app.config['S3_BUCKET'])
+    click.echo(f"deleted {deleted} objects")
+
+
+@api.cli.command("reconcile-storage")
+@click.option("--min-age-hours", default=24,
+              help="Ignore objects newer than this (in-flight uploads).")
+def reconcile_storage_command(min_age_hours):
+    """Queue S3 objects that no image row refers to for deletion."""
+
+    queued = reconcile_storage(get_s3(), current_app.config['S3_BUCKET'],
+                               timedelta(hours=min_age_hours))
+    click.echo(f"queued {queued} orphaned objects")
+
+
+@api.cli.command("render-variants")
+def render_variants_command():
+    """Render resized variants for every image that has none."""
+
+    images = Images.query.filter(~Images.variants.any()).all()
+
+    futures = [submit_variants(image.id) for image in images]
+    for future in futures:
+        future.result()
+
+    click.echo(f"rendered variants for {len(futures)} images")
+
+
+def rebuild_interest_index(app, index):
+    """Reload `index` from the database; runs on its own thread."""
+
+    with app.app_context():
+        try:
+            rows = db.session.query(User.username, User.hobbies, User.interests)
+            index.rebuild(rows.yield_per(10000), built_at=time.monotonic())
+        except Exception:
+            app.logger.exception("rebuilding the interest index failed")
+        finally:
+            db.session.remove()
+
+
+def get_interest_index():
+    """Return the interest index, starting a background rebuild if it is
+    missing or stale. Until the first build finishes every score is 0."""
+
+    built_at = interest_index.built_at
+    stale = (built_at is None
+             or time.monotonic() - built_at > current_app.config['INTEREST_INDEX_TTL'])
+
+    if stale and interest_index.start_rebuild():
+        threading.Thread(
+            target=rebuild_interest_index,
+            args=(current_app._get_current_object(), interest_index._get_current_object()),
+            daemon=True, name="interest-index").start()
+
+    return interest_index
+
+
+def current_user():
+    """Return the User for the request's JWT identity, loaded once per
+    request."""
+
+    if "current_user" not in g:
+        g.current_user = User.query.get(get_jwt_identity())
+
+    return g.current_user
+
+
+def load_user(username):
+    """Return the User called `username` (or None), reusing the request's
+    current user when it is the same one."""
+
+    if username == get_jwt_identity():
+        return current_user()
+
+    return User.query.get(username)
+
+
+def cache_profile(user):
+    """Cache and return a user's serialized profile. Profiles read from
+    the replica aren't cached."""
+
+    profile = user.to_dict()
+    if may_fill_cache():
+        profiles.set(user.username, profile)
+
+    return profile
+
+
+def get_profiles(usernames):
+    """Return {username: user.to_dict()} for the usernames that exist,
+    from the profile cache where possible and one query for the rest."""
+
+    found = {}
+    missing = []
+    use_cache = may_read_cache()
+
+    for username in usernames:
+        profile = profiles.get(username) if use_cache else None
+        if profile is None:
+            missing.append(username)
+        else:
+            found[username] = profile
+
+    if missing:
+        for user in User.query.filter(User.username.in_(missing)):
+            found[user.username] = cache_profile(user)
+
+    return found
+
+
+def get_deck(user):
+    """Return the user's (usernames, distances) candidate deck, from the
+    deck cache when possible."""
+
+    deck = decks.get(user) if may_read_cache() else None
+    if deck is None:
+        deck = User.find_candidates(user)
+        if may_fill_cache():
+            decks.set(user, *deck)
+
+    return deck
+
+
 ####################User signup/login/logout#############################
 
 
-@app.route('/api/signup', methods=["POST"])
+@api.route('/api/signup', methods=["POST"])
 def signup():
     """Handle user signup.
     Create new user, add to db, return JWT.
@@ -60,8 +453,11 @@ def signup():
         password=request.json["password"]
         location= request.json["location"]
 
-        User.signup(username, email, password, location)
+        user = User.signup(username, email, password, location)
         db.session.commit()
+        mark_write(username)
+        decks.invalidate_near(user.latitude, user.longitude)
+        interest_index.add(username, user.hobbies, user.interests)
         access_token = create_access_token(identity=username)
 
         return jsonify(access_token=access_token)
@@ -70,7 +466,7 @@ def signup():
         return jsonify(msg = "Username already taken")
 
 
-@app.route('/api/token', methods=["POST"])
+@api.route('/api/token', methods=["POST"])
 def login():
     """{ username, password } => { token }
     Takes in user and password and returns JWT.
@@ -80,6 +476,8 @@ def login():
                                  request.json["password"])
 
     if user:
+        # saves a rehashed password, if authenticate upgraded it
+        db.session.commit()
         access_token = create_access_token(identity=user.username)
         return jsonify(access_token=access_token)
 
@@ -89,38 +487,116 @@ def login():
 
 ############# USER ROUTES ############################
 
-@app.get("/api/users")
+@api.get("/api/users")
 @jwt_required()
+@use_replica
 def get_users():
-    """ Get all users that fall within location paramaters.
-        Returns: {users: [{username, email, hobbies, bio, interests, location, friend_radius}, ...]}
+    """ Get all users that fall within location paramaters, both ways, and
+        haven't already been matched/unmatched by or unfriended the user,
+        most similar hobbies/interests first (then nearest).
+        Returns: {matches: [{username, email, hobbies, bio, interests, location, friend_radius, distance, score}, ...]}
+
+        With a `limit` query parameter, return one page of the nearest users
+        instead, closest first. Pass the returned `next_cursor` back as
+        `cursor` for the following page:
+        {matches: [...], next_cursor}
     """
-    username = get_jwt_identity()
+    curr_user = current_user()
+
+    if curr_user.latitude is None:
+        return jsonify(matches=[], next_cursor=None)
+
+    usernames, distances = get_deck(curr_user)
+
+    if "limit" not in request.args:
+        scores = get_interest_index().scores(
+            tokenize(curr_user.hobbies, curr_user.interests), usernames)
+        order = np.lexsort((distances, -scores))
+
+        users = get_profiles(usernames)
 
-    curr_user = User.query.get(username)
-    users = User.query.all()
+        matches = [{**users[usernames[i]],
+                    "distance": float(distances[i]),
+                    "score": round(float(scores[i]), 4)}
+                   for i in order if usernames[i] in users]
 
-    users = [user.to_dict() for user in User.query.all() if user.username != username]
+        return jsonify(matches=matches)
 
-    matches = Distance.get_location_matches(curr_user.location, users, curr_user.friend_radius)
+    try:
+        limit = get_limit(request.args["limit"])
+        cursor = request.args.get("cursor")
+        after = decode_cursor(cursor) if cursor else None
+        page = nearest_page(distances, usernames, limit, after)
+    except (ValueError, TypeError):
+        return jsonify(msg="Invalid limit or cursor!")
+
+    users = get_profiles([usernames[i] for i in page])
+
+    matches = [{**users[usernames[i]], "distance": float(distances[i])}
+               for i in page if usernames[i] in users]
 
-    return jsonify(matches=matches)
+    next_cursor = None
+    if len(page) == limit:
+        last = page[-1]
+        next_cursor = encode_cursor(float(distances[last]), usernames[last])
 
-@app.get('/api/users/<username>')
+    return jsonify(matches=matches, next_cursor=next_cursor)
+
+@api.get("/api/search/users")
 @jwt_required()
+def search():
+    """ Full-text search over users' bio, hobbies and interests, most relevant
+        first. `q` is the search text, paged by `limit` (default 20) and
+        `offset`. With `nearby=true` only users in the current user's
+        candidate deck are searched.
+        Returns: {users: [{username, ..., rank}, ...], next_offset}
+    """
+
+    try:
+        limit = get_limit(request.args.get("limit"))
+        offset = max(0, request.args.get("offset", 0, type=int))
+    except ValueError:
+        return jsonify(msg="Invalid limit or offset!")
+
+    usernames = None
+    if request.args.get("nearby") == "true":
+        curr_user = current_user()
+        if curr_user.latitude is None:
+            return jsonify(users=[], next_offset=None)
+
+        usernames, _ = get_deck(curr_user)
+
+    found = search_users(request.args.get("q", ""), limit, offset, usernames)
+
+    users = get_profiles([username for username, _ in found])
+
+    results = [{**users[username], "rank": rank}
+               for username, rank in found if username in users]
+
+    next_offset = offset + limit if len(found) == limit else None
+
+    return jsonify(users=results, next_offset=next_offset)
+
+@api.get('/api/users/<username>')
+@jwt_required()
+@use_replica
 def get_single_user(username):
     """Return a user: {username, email, hobbies, bio, interests, location, friend_radius}
     returns {msg: "User not found!"} if no user exists"""
 
+    user = profiles.get(username) if may_read_cache() else None
+    if user is not None:
+        return jsonify(user=user)
+
     try:
-        user = User.query.get(username)
-        user = user.to_dict()
+        user = load_user(username)
+        user = cache_profile(user)
         return jsonify(user=user)
     except AttributeError:
         return jsonify({"msg": "User not found!"})
 
 
-@app.patch('/api/users/<username>')
+@api.patch('/api/users/<username>')
 @jwt_required()
 def edit_single_user(username):
     """Update a user and return user object:
@@ -130,15 +606,26 @@ def edit_single_user(username):
     data = request.json
 
     try:
-        user = User.query.get(username)
+        user = load_user(username)
+        before = (user.latitude, user.longitude, user.friend_radius)
+
         user.hobbies = data.get('hobbies', user.hobbies)
         user.bio = data.get('bio', user.bio)
         user.interests = data.get('interests', user.interests)
-        user.location = data.get('location', user.location)
+        if 'location' in data:
+            user.set_location(data['location'])
         user.friend_radius = data.get('friend_radius', user.friend_radius)
 
         db.session.add(user)
         db.session.commit()
+        profiles.pop(username)
+
+        interest_index.add(username, user.hobbies, user.interests)
+
+        if before != (user.latitude, user.longitude, user.friend_radius):
+            decks.invalidate(username)
+            decks.invalidate_near(before[0], before[1])
+            decks.invalidate_near(user.latitude, user.longitude)
 
         user = user.to_dict()
         return jsonify(user=user)
@@ -147,33 +634,46 @@ def edit_single_user(username):
         return jsonify({"msg": "User not found!"})
 
 
-@app.delete('/api/users/<username>')
+@api.delete('/api/users/<username>')
 @jwt_required()
 def delete_user(username):
     """Delete a user"""
 
     try:
-        user = User.query.get(username)
+        user = load_user(username)
+        lat, lon = user.latitude, user.longitude
+        StorageDeletion.enqueue(object_keys_for_user(username))
         db.session.delete(user)
         db.session.commit()
+        profiles.pop(username)
+
+        decks.invalidate(username)
+        decks.invalidate_near(lat, lon)
+        interest_index.remove(username)
         return jsonify(msg="deleted sucessfully")
     except AttributeError:
         return jsonify({"msg": "User not found!"})
 
 
-@app.post('/api/users/<username>/match')
+@api.post('/api/users/<username>/match')
 @jwt_required()
 def match_person(username):
     """Match with another user. Returns message if successful."""
 
     match_username = request.json["match"]
-    match = Match.add_match(username,match_username)
-    db.session.commit()
-    if match:
-        return jsonify(msg="friended successfully")
 
+    try:
+        Match.record_swipes(username, {match_username: False})
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify(msg="User not found!")
+
+    decks.invalidate(username, match_username)
+    return jsonify(msg="friended successfully")
 
-@app.post('/api/users/<username>/unmatch')
+
+@api.post('/api/users/<username>/unmatch')
 @jwt_required()
 def unmatch_person(username):
     """Unmatch with another user."""
@@ -188,25 +688,96 @@ def unmatch_person(username):
 
     match.unfriended = True
     db.session.commit()
+    decks.invalidate(username, match_username)
     return jsonify(msg="unfriended successfully")
 
 
 
+@api.get('/api/users/<username>/matches/mutual')
+@jwt_required()
+def get_mutual_matches(username):
+    """Get the users this user is mutually matched with.
+    Pass `usernames` (comma separated, at most MAX_SWIPE_BATCH) to only
+    check those users.
+    Returns {mutual: [username, ...]}"""
+
+    candidates = None
+    if "usernames" in request.args:
+        candidates = request.args["usernames"].split(",")
+        if len(candidates) > MAX_SWIPE_BATCH:
+            return jsonify(msg=f"At most {MAX_SWIPE_BATCH} usernames!")
+
+    return jsonify(mutual=Match.mutual_matches(username, candidates))
+
+
+@api.post('/api/users/<username>/swipes')
+@jwt_required()
+def swipe_batch(username):
+    """Record a batch of match/unmatch decisions in one transaction.
+    Takes {decisions: [{username, action: "match" | "unmatch"}, ...]};
+    a later decision for the same user wins. At most MAX_SWIPE_BATCH
+    decisions per request.
+    Returns {msg, count}."""
+
+    decisions = {}
+
+    try:
+        if len(request.json["decisions"]) > MAX_SWIPE_BATCH:
+            return jsonify(msg=f"At most {MAX_SWIPE_BATCH} decisions!")
+
+        for decision in request.json["decisions"]:
+            if decision["action"] not in ("match", "unmatch"):
+                return jsonify(msg="Invalid action!")
+            decisions[decision["username"]] = decision["action"] == "unmatch"
+    except (KeyError, TypeError):
+        return jsonify(msg="Invalid decisions!")
+
+    try:
+        Match.record_swipes(username, decisions)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify(msg="User not found!")
+
+    decks.invalidate(username, *decisions)
+
+    return jsonify(msg="swipes recorded", count=len(decisions))
+
+
 ############# USER PHOTO ROUTES ############################
 
-@app.get('/api/users/<username>/photos')
+@api.get('/api/users/<username>/photos')
 @jwt_required()
+@use_replica
 def get_photos(username):
-    """Get all photos of a user"""
+    """Get all photos of a user.
+    Each photo's path is the smallest resized variant at least `width` px
+    wide (WebP with `webp=true`, if rendered), or the original until its
+    variants are ready. All variants are listed under `variants`."""
+
+    User.query.get_or_404(username)
+
+    width = request.args.get("width", type=int)
+    webp = request.args.get("webp") == "true"
 
-    user = User.query.get_or_404(username)
-    images = user.images
-    images = [image.to_dict() for image in images]
+    images = (Images.query
+              .options(db.selectinload(Images.variants))
+              .filter(Images.username == username)
+              .order_by(Images.id))
 
-    return jsonify(images=images)
+    photos = []
+    for image in images:
+        photo = image.to_dict()
+        variant = image.pick_variant(width, webp)
+        if variant:
+            photo["path"] = variant.path
+        photo["variants"] = [variant.to_dict() for variant in image.variants]
+        photos.append(photo)
 
+    return jsonify(images=photos)
 
-@app.post('/api/users/<username>/photos')
+
+@api.post('/api/users/<username>/photos')
 @jwt_required()
 def upload_pic(username):
     """Upload a picture"""
@@ -216,26 +787,86 @@ def upload_pic(username):
     if img:
         filename = secure_filename(img.filename)
         filename = str(uuid.uuid1())
-        s3.put_object(
+        get_s3().put_object(
             Body=img,
-            Bucket = app.config['S3_BUCKET'],
+            Bucket = current_app.config['S3_BUCKET'],
             Key = filename,
             ContentType="image/jpeg"
         )
 
-        file_path = "{}{}".format(app.config["S3_LOCATION"], filename)
+        file_path = "{}{}".format(current_app.config["S3_LOCATION"], filename)
 
         user = User.query.get_or_404(username)
         image = Images.create_new_image(username, file_path, filename)
         user.images.append(image)
         db.session.commit()
+        profiles.pop(username)
+        submit_variants(image.id)
 
         return jsonify(file_path=file_path,msg="success")
 
     return jsonify(msg="no image specified")
 
 
-@app.delete('/api/users/<username>/photos/<int:photo_id>')
+@api.post('/api/users/<username>/photos/uploads')
+@jwt_required()
+def start_photo_upload(username):
+    """Get a presigned URL to PUT a photo to directly. Send the bytes with
+    the returned headers, then call .../photos/uploads/complete with the key.
+    Returns {url, key, headers, expires_in}"""
+
+    key = new_photo_key(username)
+    expires_in = current_app.config['PHOTO_UPLOAD_EXPIRES']
+
+    url = presign_upload(get_s3(), current_app.config['S3_BUCKET'], key, expires_in)
+
+    return jsonify(url=url, key=key, headers={"Content-Type": "image/jpeg"},
+                   expires_in=expires_in)
+
+
+@api.post('/api/users/<username>/photos/uploads/complete')
+@jwt_required()
+def complete_photo_upload(username):
+    """Record a photo uploaded through a presigned URL.
+    Takes {key}; returns {image, msg}."""
+
+    key = request.json.get("key") if isinstance(request.json, dict) else None
+
+    if not is_photo_key(username, key):
+        return jsonify(msg="Invalid key!")
+
+    image = Images.query.filter_by(username=username, filename=key).one_or_none()
+    if image:
+        return jsonify(image=image.to_dict(), msg="success")
+
+    info = get_object_info(get_s3(), current_app.config['S3_BUCKET'], key)
+    if info is None:
+        return jsonify(msg="Upload not found!")
+
+    if info['ContentLength'] > current_app.config['MAX_PHOTO_BYTES']:
+        StorageDeletion.enqueue([key])
+        db.session.commit()
+        return jsonify(msg="Image too large!")
+
+    file_path = "{}{}".format(current_app.config["S3_LOCATION"], key)
+
+    try:
+        image = Images.create_new_image(username, file_path, key)
+        db.session.commit()
+    except IntegrityError:
+        # another request completed the same upload first, or no such user
+        db.session.rollback()
+        image = Images.query.filter_by(username=username, filename=key).one_or_none()
+        if image is None:
+            return jsonify(msg="User not found!")
+
+    profiles.pop(username)
+    submit_variants(image.id)
+
+    return jsonify(image=image.to_dict(), msg="success")
+
+
+@api.delete('/api/users/<username>/photos/<int:photo_id>')
 @jwt_required()
 def delete_photos(username, photo_id):
     """Delete a user photo"""
@@ -243,12 +874,11 @@ def delete_photos(username, photo_id):
     try:
         image = Images.query.get(photo_id)
 
-        response = s3.delete_object(
-        Bucket=app.config['S3_BUCKET'],
-        Key=image.filename
-)
+        StorageDeletion.enqueue(
+            [image.filename] + [variant.filename for variant in image.variants])
         db.session.delete(image)
         db.session.commit()
+        profiles.pop(username)
 
         return jsonify(msg="deleted sucessfully")
 
@@ -257,47 +887,182 @@ def delete_photos(username, photo_id):
 
 ############# Messages ROUTES ############################
 
-@app.get("/api/users/<username>/messages")
+def publish_message(message):
+    """Push a new message to the recipient's open streams."""
+
+    broker.publish(f"messages:{message.user_to}",
+                   flask_json.dumps(message.to_dict()))
+
+
+@api.get("/api/users/<username>/messages")
 @jwt_required()
+@use_replica
 def get_messages(username):
     """ Get all user messages
         Returns: {messages: [{id, id_from, id_to, text, sent_at}, ...]}
     """
 
-    user = User.query.get(username)
+    user = load_user(username)
     messages = [message.to_dict() for message in user.messages]
 
     return jsonify(messages=messages)
 
-@app.get('/api/users/<user_from>/<user_to>')
+@api.get("/api/users/<username>/inbox")
+@jwt_required()
+@use_replica
+def get_inbox(username):
+    """ Get a user's conversations, most recent first (`limit`, default 50)
+        Returns: {conversations: [{partner, last_message, last_sent_at, unread_count}, ...]}
+    """
+
+    try:
+        limit = get_limit(request.args.get("limit"), default=50)
+    except ValueError:
+        return jsonify(msg="Invalid limit!")
+
+    conversations = [conversation.to_dict()
+                     for conversation in Conversation.inbox(username, limit)]
+
+    return jsonify(conversations=conversations)
+
+@api.post("/api/users/<username>/inbox/<partner>/read")
+@jwt_required()
+def mark_conversation_read(username, partner):
+    """Mark a user's conversation with partner as read."""
+
+    Conversation.mark_read(username, partner)
+    db.session.commit()
+
+    return jsonify(msg="marked read")
+
+@api.get("/api/users/<username>/messages/stream")
+@jwt_required(locations=["headers", "query_string"])
+@use_replica
+def stream_messages(username):
+    """ Server-sent events stream of messages sent to a user.
+        Each event is `event: message` with the message JSON as data and its
+        id as the event id. On reconnect, every message after the
+        Last-Event-ID header is replayed first, a page at a time. Accepts the
+        JWT as ?jwt= for EventSource.
+
+        Each open stream holds a worker thread, so serve it from a threaded
+        or gevent worker.
+    """
+
+    last_event_id = request.headers.get("Last-Event-ID", type=int)
+    keepalive = current_app.config['STREAM_KEEPALIVE']
+
+    def event(message_id, payload):
+        return f"id: {message_id}\nevent: message\ndata: {payload}\n\n"
+
+    def stream():
+        # subscribe before replaying so nothing sent in between is lost
+        subscription = broker.subscribe(f"messages:{username}")
+
+        try:
+            yield f"retry: {keepalive * 1000}\n\n"
+
+            # replay a page at a time until caught up
+            last_id = last_event_id
+            while last_id is not None:
+                missed = (Message.query
+                          .filter(Message.user_to == username,
+                                  Message.id > last_id)
+                          .order_by(Message.id)
+                          .limit(MAX_PAGE_SIZE)
+                          .all())
+                for message in missed:
+                    yield event(message.id, flask_json.dumps(message.to_dict()))
+                    last_id = message.id
+                if len(missed) < MAX_PAGE_SIZE:
+                    break
+
+            # don't pin a pooled connection for the life of the stream
+            db.session.close()
+
+            while True:
+                payload = subscription.get(timeout=keepalive)
+                if payload is None:
+                    yield ": keepalive\n\n"
+                    continue
+
+                # skip what the replay already sent
+                message_id = json.loads(payload)["id"]
+                if last_id is None or message_id > last_id:
+                    yield event(message_id, payload)
+        finally:
+            subscription.close()
+
+    return Response(stream_with_context(stream()),
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@api.get('/api/users/<user_from>/<user_to>')
 @jwt_required()
+@use_replica
 def get_messages_to_user(user_from,user_to):
-    """ Get all messages between the current user and another user
+    """ Get messages between the current user and another user, both ways,
+        oldest first. Returns the newest `limit` (default 50) messages, or
+        the page before or after a message id given as `before` or `after`
+        (not both).
         Returns: {messages: [{id, id_from, id_to, text, sent_at}, ...]}
     """
-    user = User.query.get(user_from)
-    messages = [message.to_dict() for message in user.messages if message.user_to == user_to or message.user_from == user_to]
+
+    try:
+        limit = get_limit(request.args.get("limit"), default=50)
+        before = request.args.get("before", type=int)
+        after = request.args.get("after", type=int)
+        messages = Message.conversation(user_from, user_to, limit, before, after)
+    except ValueError:
+        return jsonify(msg="Invalid limit or cursor!")
+
+    messages = [message.to_dict() for message in messages]
 
     return jsonify(messages=messages)
 
-@app.post('/api/users/<user_from>/<user_to>')
+@api.post('/api/users/<user_from>/<user_to>')
 @jwt_required()
 def send_message(user_from,user_to):
     """ Send a message to a user
         Returns conversation: {message: [{id, id_from, id_to, text, sent_at}, ...]}
+
+        If the body has a `since_id` (the newest message id the client has),
+        return only the new message and up to MAX_PAGE_SIZE of the
+        conversation's messages after `since_id` instead, oldest first:
+        {message: {...}, messages: [...], has_more}
+        With has_more, fetch the rest with GET ?after=<last id in messages>.
     """
 
     message_data = request.json
-    user = User.query.get(user_from)
 
     message_user_from = user_from
     message_user_to = user_to
     message_text = message_data["text"]
 
+    if "since_id" in message_data:
+        try:
+            since_id = int(message_data["since_id"])
+        except (TypeError, ValueError):
+            return jsonify(msg="Invalid since_id!")
+
+        new_message = Message.add_message(message_user_from,message_user_to,message_text)
+        db.session.commit()
+        publish_message(new_message)
+
+        messages = Message.since(user_from, user_to, since_id, MAX_PAGE_SIZE + 1)
+        has_more = len(messages) > MAX_PAGE_SIZE
+
+        messages = [message.to_dict() for message in messages[:MAX_PAGE_SIZE]]
+
+        return jsonify(message=new_message.to_dict(), messages=messages, has_more=has_more)
+
+    user = load_user(user_from)
+
     new_message = Message.add_message(message_user_from,message_user_to,message_text)
     user.messages.append(new_message)
     db.session.commit()
+    publish_message(new_message)
 
     messages = [message.to_dict() for message in user.messages if message.user_to == user_to]
 
-    return jsonify(messages=messages)
\ No newline at end of file
+    return jsonify(messages=messages)
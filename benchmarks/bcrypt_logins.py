@@ -0,0 +1,61 @@
+"""Measure password checks (logins) per second through PasswordHasher.
+
+    python benchmarks/bcrypt_logins.py --rounds 12 --seconds 10
+
+Runs the same number of concurrent logins against a hasher with one worker
+process and with one per core, and reports logins/sec and logins/sec/core.
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordHasher
+
+
+def run(workers, rounds, seconds, concurrency):
+    """Return logins/sec for `concurrency` threads logging in for `seconds`."""
+
+    hasher = PasswordHasher(rounds, workers)
+    hashed = hasher.hash("correct horse battery staple")
+
+    deadline = time.perf_counter() + seconds
+
+    def login_loop():
+        count = 0
+        while time.perf_counter() < deadline:
+            assert hasher.check(hashed, "correct horse battery staple")
+            count += 1
+        return count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as threads:
+        total = sum(threads.map(lambda _: login_loop(), range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    hasher.shutdown()
+
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=(os.cpu_count() or 1) * 2)
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+
+    for workers in sorted({1, cores}):
+        rate = run(workers, args.rounds, args.seconds, args.concurrency)
+        print(f"rounds={args.rounds} workers={workers}: "
+              f"{rate:.1f} logins/sec, {rate / workers:.1f} logins/sec/core")
+
+
+if __name__ == "__main__":
+    main()
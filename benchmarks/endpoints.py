@@ -0,0 +1,382 @@
+"""Measure API latency and throughput against a seeded database.
+
+    python benchmarks/endpoints.py --users 100000 --requests 500
+    python benchmarks/endpoints.py --users 100000 --compare benchmarks/results/old.json
+
+Seeds a database with generator/create_csvs.py and generator/load_csvs.py
+(once per --users/--seed; later runs start from a copy of it), then
+sends --requests requests per scenario through the Flask test client from
+--concurrency threads and reports p50/p99 latency and requests/sec. Requests run in
+process, so the numbers cover the app, the database and S3 calls but not
+HTTP parsing or the network.
+
+S3 is moto's in-process mock, so photo routes never leave the machine
+(pip install -r requirements-dev.txt). The generator needs the zipcode table
+(python zipcode.py US.txt).
+
+A request counts as an error if it fails with an HTTP error or, since the
+API reports most failures as a 200 with a message, if it answers with a
+`msg` that isn't one of SUCCESS_MESSAGES.
+
+Results are written as JSON to benchmarks/results/ (named after the scale
+and commit); --compare prints the change against an earlier result file.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "generator"))
+
+from create_csvs import generate
+from helpers import make_username
+from load_csvs import load
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+BUCKET = "friender-benchmark"
+
+PASSWORD = "password"
+
+# every `msg` the API sends on success; any other msg is a failure
+SUCCESS_MESSAGES = {
+    "success", "swipes recorded", "friended successfully", "unfriended successfully",
+    "deleted sucessfully", "marked read",
+}
+
+
+def get_commit():
+    """Return the short hash of HEAD, or "unknown" outside a git checkout."""
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def make_jpeg():
+    """Return the bytes of a small JPEG to upload."""
+
+    from PIL import Image
+
+    data = io.BytesIO()
+    Image.new("RGB", (640, 480), (200, 120, 80)).save(data, "JPEG")
+
+    return data.getvalue()
+
+
+def seed(app, num_users, seed_value, rounds):
+    """Generate and load `num_users` users unless the database has them."""
+
+    from models import db, User
+
+    with app.app_context():
+        db.create_all()
+        existing = User.query.count()
+        if existing == num_users:
+            print(f"reusing database with {existing} users")
+            return
+        if existing:
+            sys.exit(f"database has {existing} users, not {num_users}; "
+                     "use an empty database or --database-url")
+
+        with tempfile.TemporaryDirectory() as directory:
+            import bcrypt
+
+            start = time.perf_counter()
+            password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds)).decode()
+            generate(directory, num_users, matches_per_user=10,
+                     num_messages=num_users * 5, messages_per_conversation=20,
+                     images_per_user=3, password_hash=password_hash,
+                     image_location=app.config['S3_LOCATION'], chunk_size=10000,
+                     seed=seed_value)
+            loaded = load(directory, chunk_size=10000)
+            print(f"seeded {loaded} in {time.perf_counter() - start:.1f}s")
+
+
+class Scenarios:
+    """Requests to benchmark. Each scenario method takes the request number
+    and does any untimed setup, then returns the (method, path, kwargs) of
+    the request to time."""
+
+    def __init__(self, app, num_users, rng):
+        from flask_jwt_extended import create_access_token
+        from models import db, Conversation
+
+        self.app = app
+        self.jpeg = make_jpeg()
+
+        with app.app_context():
+            self.usernames = [make_username(int(i))
+                              for i in rng.integers(0, num_users, 1000)]
+            # users acted on (matched, viewed), in a different order
+            self.others = [make_username(int(i))
+                           for i in rng.integers(0, num_users, 997)]
+            self.tokens = {username: create_access_token(identity=username)
+                           for username in self.usernames}
+            self.conversations = db.session.query(
+                Conversation.username, Conversation.partner).limit(1000).all()
+            for username, _ in self.conversations:
+                self.tokens.setdefault(username, create_access_token(identity=username))
+            db.session.remove()
+
+        self.client = app.test_client()
+
+    def user(self, i):
+        """Return (username, auth headers) of the i'th benchmark user."""
+
+        username = self.usernames[i % len(self.usernames)]
+        return username, {"Authorization": f"Bearer {self.tokens[username]}"}
+
+    def conversation(self, i):
+        """Return (username, partner, auth headers) of a conversation."""
+
+        username, partner = self.conversations[i % len(self.conversations)]
+        return username, partner, {"Authorization": f"Bearer {self.tokens[username]}"}
+
+    def other(self, i):
+        return self.others[i % len(self.others)]
+
+    def token(self, i):
+        username, _ = self.user(i)
+        return "POST", "/api/token", dict(json=dict(username=username, password=PASSWORD))
+
+    def users_page(self, i):
+        _, headers = self.user(i)
+        return "GET", "/api/users?limit=20", dict(headers=headers)
+
+    def users_ranked(self, i):
+        _, headers = self.user(i)
+        return "GET", "/api/users", dict(headers=headers)
+
+    def user_profile(self, i):
+        _, headers = self.user(i)
+        return "GET", f"/api/users/{self.other(i)}", dict(headers=headers)
+
+    def match(self, i):
+        username, headers = self.user(i)
+        return "POST", f"/api/users/{username}/match", dict(
+            headers=headers, json=dict(match=self.other(i)))
+
+    def unmatch(self, i):
+        username, headers = self.user(i)
+        return "POST", f"/api/users/{username}/unmatch", dict(
+            headers=headers, json=dict(unmatch=self.other(i)))
+
+    def messages(self, i):
+        username, _, headers = self.conversation(i)
+        return "GET", f"/api/users/{username}/messages", dict(headers=headers)
+
+    def inbox(self, i):
+        username, _, headers = self.conversation(i)
+        return "GET", f"/api/users/{username}/inbox", dict(headers=headers)
+
+    def conversation_page(self, i):
+        username, partner, headers = self.conversation(i)
+        return "GET", f"/api/users/{username}/{partner}?limit=50", dict(headers=headers)
+
+    def send_message(self, i):
+        username, partner, headers = self.conversation(i)
+        return "POST", f"/api/users/{username}/{partner}", dict(
+            headers=headers, json=dict(text=f"benchmark message {i}", since_id=0))
+
+    def photos(self, i):
+        username, headers = self.user(i)
+        return "GET", f"/api/users/{username}/photos", dict(headers=headers)
+
+    def photo_presign(self, i):
+        username, headers = self.user(i)
+        return "POST", f"/api/users/{username}/photos/uploads", dict(headers=headers)
+
+    def upload(self, i):
+        """Upload a photo to S3 (untimed); returns (username, headers, key)."""
+
+        import requests
+
+        username, headers = self.user(i)
+        upload = self.client.post(f"/api/users/{username}/photos/uploads",
+                                  headers=headers).json
+        requests.put(upload["url"], data=self.jpeg, headers=upload["headers"])
+
+        return username, headers, upload["key"]
+
+    def photo_complete(self, i):
+        username, headers, key = self.upload(i)
+        return "POST", f"/api/users/{username}/photos/uploads/complete", dict(
+            headers=headers, json=dict(key=key))
+
+    def photo_delete(self, i):
+        username, headers, key = self.upload(i)
+        image = self.client.post(f"/api/users/{username}/photos/uploads/complete",
+                                 headers=headers, json=dict(key=key)).json["image"]
+        return "DELETE", f"/api/users/{username}/photos/{image['id']}", dict(headers=headers)
+
+    NAMES = ["token", "users_page", "users_ranked", "user_profile", "match",
+             "unmatch", "messages", "inbox", "conversation_page", "send_message",
+             "photos", "photo_presign", "photo_complete", "photo_delete"]
+
+
+def is_error(response):
+    """Did the request fail, by status code or by its `msg`?"""
+
+    if response.status_code >= 400:
+        return True
+
+    body = response.get_json(silent=True)
+    return (isinstance(body, dict) and "msg" in body
+            and body["msg"] not in SUCCESS_MESSAGES)
+
+
+def run_scenario(scenarios, name, num_requests, concurrency):
+    """Send `num_requests` requests of one scenario; returns its stats."""
+
+    scenario = getattr(scenarios, name)
+
+    def send(i):
+        method, path, kwargs = scenario(i)
+        start = time.perf_counter()
+        response = scenarios.client.open(path, method=method, **kwargs)
+        elapsed = time.perf_counter() - start
+        return elapsed, is_error(response)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as threads:
+        results = list(threads.map(send, range(num_requests)))
+    wall = time.perf_counter() - start
+
+    latencies = np.array([elapsed for elapsed, _ in results]) * 1000
+
+    return dict(
+        requests=num_requests,
+        errors=sum(error for _, error in results),
+        p50_ms=round(float(np.percentile(latencies, 50)), 3),
+        p99_ms=round(float(np.percentile(latencies, 99)), 3),
+        mean_ms=round(float(latencies.mean()), 3),
+        # setup time (e.g. uploads to S3) counts against throughput
+        requests_per_sec=round(num_requests / wall, 1),
+    )
+
+
+def compare(results, path):
+    """Print each scenario's p50/p99/throughput change against `path`."""
+
+    with open(path) as file:
+        old = json.load(file)["results"]
+
+    print(f"\nchange against {path}:")
+    for name, stats in results.items():
+        if name not in old:
+            continue
+        changes = [f"{key} {(stats[key] / old[name][key] - 1) * 100:+.1f}%"
+                   for key in ("p50_ms", "p99_ms", "requests_per_sec") if old[name][key]]
+        print(f"{name:>18}: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1000,
+                        help="Seeded users, e.g. 1000, 100000 or 1000000.")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="Requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--scenario", action="append", choices=Scenarios.NAMES,
+                        help="Run only this scenario (repeatable).")
+    parser.add_argument("--database-url",
+                        help="Database to seed (if empty) and use; benchmark writes "
+                             "stay in it. Default: a copy of a SQLite file seeded "
+                             "under benchmarks/data/ per --users and --seed.")
+    parser.add_argument("--rounds", type=int, default=12,
+                        help="bcrypt cost of the seeded passwords and the app.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Result file (default: benchmarks/results/"
+                                      "<users>-<commit>.json).")
+    parser.add_argument("--compare", help="Earlier result file to compare against.")
+    args = parser.parse_args()
+
+    from moto import mock_aws
+    from app import create_app
+    from models import db
+
+    def make_app(database_url):
+        return create_app(dict(
+            SQLALCHEMY_DATABASE_URI=database_url.replace("postgres://", "postgresql://"),
+            SECRET_KEY="benchmark",
+            S3_KEY="benchmark",
+            S3_SECRET="benchmark",
+            S3_BUCKET=BUCKET,
+            S3_REGION="us-east-1",
+            BCRYPT_LOG_ROUNDS=args.rounds,
+            JWT_ACCESS_TOKEN_EXPIRES=False,
+        ))
+
+    workdir = tempfile.TemporaryDirectory()
+
+    if args.database_url is None:
+        # seed a SQLite file once, and run every benchmark on a fresh copy
+        # of it so writes from earlier runs don't skew later ones
+        os.makedirs(os.path.join(BENCHMARKS, "data"), exist_ok=True)
+        seeded = os.path.join(BENCHMARKS, "data", f"friender-{args.users}-{args.seed}.db")
+        with mock_aws():
+            seed(make_app(f"sqlite:///{seeded}"), args.users, args.seed, args.rounds)
+
+        copy = os.path.join(workdir.name, "friender.db")
+        shutil.copyfile(seeded, copy)
+        app = make_app(f"sqlite:///{copy}")
+    else:
+        app = make_app(args.database_url)
+        with mock_aws():
+            seed(app, args.users, args.seed, args.rounds)
+
+    with mock_aws():
+        with app.app_context():
+            from app import get_s3
+            get_s3().create_bucket(Bucket=BUCKET)
+
+        scenarios = Scenarios(app, args.users, np.random.default_rng(args.seed))
+
+        results = {}
+        for name in args.scenario or Scenarios.NAMES:
+            results[name] = run_scenario(scenarios, name, args.requests, args.concurrency)
+            stats = results[name]
+            print(f"{name:>18}: p50 {stats['p50_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms"
+                  f"  {stats['requests_per_sec']:8.1f} req/s  errors {stats['errors']}")
+
+        app.extensions['friender']['variant_pipeline'].shutdown()
+
+    commit = get_commit()
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        db.engine.dispose()
+    workdir.cleanup()
+
+    out = args.out or os.path.join(BENCHMARKS, "results", f"{args.users}-{commit}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as file:
+        json.dump(dict(
+            meta=dict(commit=commit, timestamp=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                      users=args.users, requests=args.requests,
+                      concurrency=args.concurrency, rounds=args.rounds,
+                      database=dialect, python=platform.python_version()),
+            results=results,
+        ), file, indent=2)
+    print(f"wrote {out}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Measure how long a fresh worker takes to become useful.
+
+    python benchmarks/startup.py --runs 5
+
+Each run starts a new interpreter (as a forked worker, CLI command or test
+run would) and times `import app`, create_app() and the first two requests
+against a throwaway SQLite database: the first pays for the database
+connection and lazy setup, the second is a warm request for comparison.
+Reports the median of each phase in milliseconds.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in the child interpreter; prints one JSON line of phase timings.
+CHILD = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+
+with flask_app.app_context():
+    app.db.create_all()
+    app.db.session.remove()
+    app.db.engine.dispose()
+
+from flask_jwt_extended import create_access_token
+with flask_app.app_context():
+    token = create_access_token(identity="nobody")
+
+client = flask_app.test_client()
+headers = {"Authorization": "Bearer " + token}
+phases = {"import": imported - start, "create_app": created - imported}
+for name in ("first_request", "second_request"):
+    before = time.perf_counter()
+    client.get("/api/users/nobody", headers=headers)
+    phases[name] = time.perf_counter() - before
+
+print(json.dumps({name: seconds * 1000 for name, seconds in phases.items()}))
+"""
+
+
+def run_once(database_url):
+    """Return {phase: milliseconds} for one fresh interpreter."""
+
+    env = dict(os.environ,
+               DATABASE_URL=database_url,
+               SECRET_KEY=os.environ.get("SECRET_KEY", "benchmark"),
+               AWS_ACCESS_KEY_ID=os.environ.get("AWS_ACCESS_KEY_ID", "benchmark"),
+               AWS_SECRET_ACCESS_KEY=os.environ.get("AWS_SECRET_ACCESS_KEY", "benchmark"),
+               BUCKET_NAME=os.environ.get("BUCKET_NAME", "benchmark"))
+
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stdout
+
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'startup.db')}"
+        runs = [run_once(database_url) for _ in range(args.runs)]
+
+    for phase in runs[0]:
+        times = [run[phase] for run in runs]
+        print(f"{phase:>15}: {statistics.median(times):8.1f} ms "
+              f"(min {min(times):.1f}, max {max(times):.1f})")
+
+
+if __name__ == "__main__":
+    main()
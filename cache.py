@@ -0,0 +1,76 @@
+"""Bounded in-process caches."""
+
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LRUCache():
+    """Thread-safe mapping holding at most `maxsize` entries, each for at most
+    `ttl` seconds (None for no expiry). The least recently used entry is
+    evicted first. `on_evict(key, value)` is called for entries dropped by
+    size or age, not for ones removed with pop()/clear()."""
+
+    def __init__(self, maxsize=1024, ttl=None, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def _evict(self, key):
+        _, value = self._data.pop(key)
+        if self.on_evict:
+            self.on_evict(key, value)
+
+    def get(self, key, default=None):
+        """Return the value for `key` and mark it recently used."""
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                self._evict(key)
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store `value`, evicting the least recently used entry if full."""
+
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._evict(next(iter(self._data)))
+
+    def pop(self, key, default=None):
+        """Remove and return the value for `key`."""
+
+        with self._lock:
+            entry = self._data.pop(key, None)
+
+        return default if entry is None else entry[1]
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,78 @@
+"""Per-user candidate deck cache for /api/users.
+
+A deck is the (usernames, distances) result of User.find_candidates. Decks
+live in a bounded LRU with a TTL; routes that change who a user could see
+invalidate the affected decks. Invalidation only reaches this worker's
+cache, so the TTL bounds how stale another worker's deck can get.
+"""
+
+import math
+
+import numpy as np
+
+from cache import LRUCache
+from geoindex import SpatialIndex
+
+
+class DeckCache():
+    """LRU/TTL cache of candidate decks, plus a spatial index of the cached
+    decks' owners for invalidating every deck near a changed user."""
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.decks = LRUCache(maxsize, ttl, on_evict=self._forget)
+        self.owners = SpatialIndex()
+        self.max_radius = 0
+
+    def _forget(self, username, deck):
+        self.owners.remove(username)
+
+    def get(self, user):
+        """Return the cached (usernames, distances) deck for `user`, or None.
+        A deck built for another location or radius is a miss."""
+
+        deck = self.decks.get(user.username)
+        if deck is None:
+            return None
+
+        lat, lon, radius, usernames, distances = deck
+        if (lat, lon, radius) != (user.latitude, user.longitude, user.friend_radius):
+            self.invalidate(user.username)
+            return None
+
+        return usernames, distances
+
+    def set(self, user, usernames, distances):
+        """Cache `user`'s deck. The arrays are made read-only."""
+
+        usernames.flags.writeable = False
+        distances.flags.writeable = False
+
+        self.decks.set(user.username, (user.latitude, user.longitude,
+                                       user.friend_radius, usernames, distances))
+        self.owners.add(user.username, user.latitude, user.longitude)
+        self.max_radius = max(self.max_radius, int(user.friend_radius))
+
+    def invalidate(self, *usernames):
+        """Drop these users' decks."""
+
+        for username in usernames:
+            self.decks.pop(username)
+            self.owners.remove(username)
+
+    def invalidate_near(self, lat, lon):
+        """Drop every deck whose owner's radius reaches (lat, lon), e.g. when a
+        user there signs up, moves, changes radius or is deleted."""
+
+        if lat is None or lon is None or math.isnan(lat) or math.isnan(lon):
+            return
+
+        nearby = self.owners.query_radius(lat, lon, self.max_radius)
+
+        for username, distance in nearby.items():
+            deck = self.decks.get(username)
+            if deck is None or distance <= deck[2]:
+                self.invalidate(username)
+
+    def clear(self):
+        self.decks.clear()
+        self.owners.rebuild([], np.array([]), np.array([]))
@@ -1,77 +1,227 @@
-"""Generate CSVs of random data for Warbler.
+"""Generate CSVs of random data for Friender.
 
-Students won't need to run this for the exercise; they will just use the CSV
-files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+    python generator/create_csvs.py --users 1000000
+
+Writes users.csv, matches.csv, messages.csv and images.csv (columns named
+after the tables) for generator/load_csvs.py to load. Needs no network:
+text comes from the word lists in helpers.py and locations are real zipcodes
+from the zipcode table (build it with `python zipcode.py US.txt`), with
+their coordinates filled in.
+
+Rows are generated and written a chunk of users at a time, so memory stays
+flat however many users you ask for. Usernames are derived from a user's
+number, so matches, messages and images can refer to users without keeping
+them around. Every user's password is --password.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
-
-MAX_WARBLER_LENGTH = 140
-
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
-FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
-
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
-
-fake = Faker()
-
-# Generate random profile image URLs to use for users
-
-image_urls = [
-    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
-    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
-    for i in range(count)
-]
-
-# Generate random header image URLs to use for users
-
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
-
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+import os
+import sys
+import time
+
+import bcrypt
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import (BIO_WORDS, HOBBIES, INTERESTS, MESSAGE_WORDS,
+                     make_lists, make_texts, make_username)
+from zipcode import zipcodes
+
+USERS_CSV_HEADERS = ['username', 'email', 'password', 'hobbies', 'bio', 'interests',
+                     'location', 'friend_radius', 'latitude', 'longitude']
+MATCHES_CSV_HEADERS = ['user_being_followed', 'user_following', 'unfriended']
+MESSAGES_CSV_HEADERS = ['user_from', 'user_to', 'text', 'sent_at']
+IMAGES_CSV_HEADERS = ['username', 'path', 'filename']
+
+FRIEND_RADII = np.array([10, 25, 50, 100, 250])
+
+MAX_MESSAGE_WORDS = 25
+
+# messages.text is VARCHAR(140); postgres rejects longer rows
+MAX_MESSAGE_LENGTH = 140
+
+# messages are spread over this many seconds up to now
+MESSAGE_HISTORY = 2 * 365 * 24 * 3600
+
+
+def open_csv(directory, name, headers):
+    """Return (file, csv writer) for a new CSV with a header row."""
+
+    file = open(os.path.join(directory, name), 'w', newline='')
+    writer = csv.writer(file)
+    writer.writerow(headers)
+
+    return file, writer
+
+
+def write_users(writer, rng, start, stop, password):
+    """Write users numbered start..stop-1."""
+
+    count = stop - start
+    table = zipcodes.table[rng.integers(0, len(zipcodes.table), count)]
+
+    for i, hobbies, bio, interests, row, radius in zip(
+            range(start, stop),
+            make_lists(rng, HOBBIES, count, 3),
+            make_texts(rng, BIO_WORDS, count, 4, 16),
+            make_lists(rng, INTERESTS, count, 3),
+            table.tolist(),
+            rng.choice(FRIEND_RADII, count).tolist()):
+        username = make_username(i)
+        zipcode, lat, lon = row
+        writer.writerow([username, f"{username}@example.com", password, hobbies,
+                         bio, interests, f"{zipcode:05d}", radius,
+                         round(lat, 5), round(lon, 5)])
+
+
+def write_matches(writer, rng, start, stop, num_users, per_user):
+    """Write up to `per_user` matches made by each of users start..stop-1.
+    About one in ten is an unfriend."""
+
+    following = np.repeat(np.arange(start, stop), per_user)
+    followed = rng.integers(0, num_users, len(following))
+    unfriended = rng.random(len(following)) < 0.1
+
+    # no matching yourself, and one row per pair
+    keep = followed != following
+    pairs = np.unique(np.stack([following[keep], followed[keep]], axis=1),
+                      axis=0, return_index=True)[1]
+    keep = np.flatnonzero(keep)[pairs]
+
+    for i in keep.tolist():
+        writer.writerow([make_username(int(followed[i])), make_username(int(following[i])),
+                         'true' if unfriended[i] else 'false'])
+
+    return len(keep)
+
+
+def write_messages(writer, rng, count, conversations, window_start, window_end):
+    """Write `count` messages, oldest first, sent within the window between
+    random pairs out of the `conversations` array of (user, user) numbers."""
+
+    picked = conversations[rng.integers(0, len(conversations), count)]
+    swap = rng.random(count) < 0.5
+    senders = np.where(swap, picked[:, 1], picked[:, 0])
+    recipients = np.where(swap, picked[:, 0], picked[:, 1])
+    sent_at = np.sort(rng.uniform(window_start, window_end, count))
+    texts = make_texts(rng, MESSAGE_WORDS, count, 1, MAX_MESSAGE_WORDS,
+                       MAX_MESSAGE_LENGTH)
+
+    for sender, recipient, text, timestamp in zip(
+            senders.tolist(), recipients.tolist(), texts, sent_at.tolist()):
+        writer.writerow([
+            make_username(sender),
+            make_username(recipient),
+            text,
+            time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp)),
+        ])
+
+
+def write_images(writer, rng, start, stop, max_per_user, location):
+    """Write 0..max_per_user images for each of users start..stop-1."""
+
+    counts = rng.integers(0, max_per_user + 1, stop - start)
+
+    for i, count in zip(range(start, stop), counts.tolist()):
+        username = make_username(i)
+        for _ in range(count):
+            key = f"{username}/{rng.bytes(16).hex()}"
+            writer.writerow([username, f"{location}{key}", key])
+
+    return int(counts.sum())
+
+
+def generate(directory, num_users, matches_per_user, num_messages,
+             messages_per_conversation, images_per_user, password_hash,
+             image_location, chunk_size, seed):
+    """Write the four CSVs to `directory`; returns {table: rows written}."""
+
+    rng = np.random.default_rng(seed)
+    written = dict(users=0, matches=0, messages=0, images=0)
+
+    files = [open_csv(directory, f"{name}.csv", headers)
+             for name, headers in (('users', USERS_CSV_HEADERS),
+                                   ('matches', MATCHES_CSV_HEADERS),
+                                   ('messages', MESSAGES_CSV_HEADERS),
+                                   ('images', IMAGES_CSV_HEADERS))]
+    (_, users), (_, matches), (_, messages), (_, images) = files
+
+    # pairs of users who message each other; both sides are random users
+    num_conversations = max(1, num_messages // messages_per_conversation)
+    conversations = rng.integers(0, num_users, (num_conversations, 2))
+    conversations = conversations[conversations[:, 0] != conversations[:, 1]]
+
+    num_chunks = -(-num_users // chunk_size)
+    now = time.time()
+    history_start = now - MESSAGE_HISTORY
+
+    try:
+        for chunk, start in enumerate(range(0, num_users, chunk_size)):
+            stop = min(start + chunk_size, num_users)
+
+            write_users(users, rng, start, stop, password_hash)
+            written['users'] += stop - start
+
+            written['matches'] += write_matches(
+                matches, rng, start, stop, num_users, matches_per_user)
+
+            # each chunk writes the next slice of message history, so the
+            # messages file (and the ids the loader gives them) stays in
+            # sent_at order
+            count = (num_messages * (chunk + 1) // num_chunks
+                     - num_messages * chunk // num_chunks)
+            if count and len(conversations):
+                window = MESSAGE_HISTORY / num_chunks
+                write_messages(messages, rng, count, conversations,
+                               history_start + chunk * window,
+                               history_start + (chunk + 1) * window)
+                written['messages'] += count
+
+            written['images'] += write_images(
+                images, rng, start, stop, images_per_user, image_location)
+    finally:
+        for file, _ in files:
+            file.close()
+
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--matches-per-user", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=None,
+                        help="Messages in total (default: 5 per user).")
+    parser.add_argument("--messages-per-conversation", type=int, default=20)
+    parser.add_argument("--images-per-user", type=int, default=3,
+                        help="Each user gets 0 to this many images.")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--rounds", type=int, default=12,
+                        help="bcrypt cost of the shared password hash.")
+    parser.add_argument("--image-location", default="http://friender.s3.amazonaws.com/",
+                        help="Prefix of image paths (the app's S3_LOCATION).")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=os.path.dirname(os.path.abspath(__file__)))
+    args = parser.parse_args()
+
+    password_hash = bcrypt.hashpw(
+        args.password.encode(), bcrypt.gensalt(args.rounds)).decode()
+
+    start = time.perf_counter()
+    written = generate(
+        args.out, args.users, args.matches_per_user,
+        args.users * 5 if args.messages is None else args.messages,
+        args.messages_per_conversation, args.images_per_user, password_hash,
+        args.image_location, args.chunk_size, args.seed)
+    elapsed = time.perf_counter() - start
+
+    for table, rows in written.items():
+        print(f"{table:>8}: {rows} rows")
+    print(f"wrote {sum(written.values())} rows in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,87 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+FIRST_NAMES = [
+    "alex", "sam", "jordan", "taylor", "casey", "riley", "morgan", "jamie",
+    "avery", "quinn", "drew", "rowan", "skyler", "parker", "reese", "emerson",
+    "finley", "harper", "kai", "logan", "marley", "noel", "oakley", "peyton",
+    "remy", "sage", "tatum", "blake", "cameron", "dakota", "elliot", "hayden",
+]
 
+HOBBIES = [
+    "hiking", "rock climbing", "cooking", "baking", "board games", "chess",
+    "running", "cycling", "yoga", "photography", "painting", "knitting",
+    "gardening", "fishing", "camping", "surfing", "skiing", "snowboarding",
+    "video games", "reading", "writing", "singing", "guitar", "piano",
+    "dancing", "swimming", "tennis", "basketball", "soccer", "volleyball",
+    "woodworking", "pottery", "birdwatching", "kayaking", "trivia nights",
+    "karaoke", "skateboarding", "bouldering", "brewing beer", "thrifting",
+]
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+INTERESTS = [
+    "jazz", "hip hop", "indie rock", "classical music", "sci-fi movies",
+    "horror films", "anime", "true crime podcasts", "history", "astronomy",
+    "philosophy", "politics", "economics", "startups", "machine learning",
+    "open source", "travel", "street food", "coffee", "wine tasting",
+    "vegan food", "sustainability", "fashion", "architecture", "museums",
+    "theater", "stand-up comedy", "poetry", "languages", "mythology",
+    "dogs", "cats", "national parks", "vintage cars", "tabletop rpgs",
+]
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+BIO_WORDS = [
+    "love", "looking", "for", "new", "friends", "who", "enjoy", "weekend",
+    "adventures", "coffee", "and", "good", "conversation", "recently", "moved",
+    "here", "always", "up", "for", "trying", "restaurants", "outdoors",
+    "music", "shows", "quiet", "nights", "in", "big", "fan", "of", "dogs",
+    "early", "riser", "night", "owl", "let's", "grab", "a", "drink", "sometime",
+]
 
-    return datetime.fromtimestamp(random_timestamp)
+MESSAGE_WORDS = [
+    "hey", "hi", "how", "are", "you", "doing", "today", "want", "to", "grab",
+    "coffee", "this", "weekend", "sounds", "great", "what", "time", "works",
+    "for", "me", "saturday", "sunday", "morning", "afternoon", "see", "you",
+    "there", "cool", "haha", "yes", "no", "maybe", "later", "thanks", "nice",
+    "the", "hike", "was", "awesome", "did", "watch", "that", "show", "yet",
+]
+
+
+def make_username(number):
+    """Return the username of user `number`; unique per number."""
+
+    return f"{FIRST_NAMES[number % len(FIRST_NAMES)]}{number}"
+
+
+def make_texts(rng, words, count, min_words, max_words, max_length=None):
+    """Return `count` sentences of min_words..max_words random words,
+    cut at a word boundary to fit in `max_length` characters."""
+
+    lengths = rng.integers(min_words, max_words + 1, count).tolist()
+    picks = rng.integers(0, len(words), sum(lengths)).tolist()
+
+    texts = []
+    start = 0
+    for length in lengths:
+        text = " ".join([words[i] for i in picks[start:start + length]])
+        if max_length is not None and len(text) >= max_length:
+            # leave room for the full stop
+            text = text[:max_length].rsplit(" ", 1)[0]
+        texts.append(text.capitalize() + "." if text else "")
+        start += length
+
+    return texts
+
+
+def make_lists(rng, phrases, count, most):
+    """Return `count` comma separated lists of 0..most distinct phrases
+    (an empty list loads as NULL)."""
+
+    lengths = rng.integers(0, most + 1, count).tolist()
+    picks = rng.integers(0, len(phrases), sum(lengths)).tolist()
+
+    lists = []
+    start = 0
+    for length in lengths:
+        chosen = dict.fromkeys(phrases[i] for i in picks[start:start + length])
+        lists.append(", ".join(chosen))
+        start += length
+
+    return lists
@@ -0,0 +1,127 @@
+"""Bulk load the CSVs written by create_csvs.py into the app's database.
+
+    python generator/load_csvs.py [--dir generator] [--chunk-size 10000]
+
+Loads users, matches, messages and images in that order (so foreign keys
+hold), then rebuilds the conversations inbox from the messages. Postgres
+loads each file with one COPY; other databases get executemany INSERTs of
+--chunk-size rows per statement. Messages and images get ids from the
+database. Create the schema first with `flask init-db`.
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Conversation
+
+TABLES = ['users', 'matches', 'messages', 'images']
+
+
+def copy_csv(table, path):
+    """Load a CSV (with a header row) into `table` with COPY; postgres only."""
+
+    with open(path, newline='') as file:
+        columns = ", ".join(next(csv.reader(file)))
+        file.seek(0)
+
+        connection = db.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT csv, HEADER)",
+                    file)
+                count = cursor.rowcount
+            connection.commit()
+        finally:
+            connection.close()
+
+    return count
+
+
+def parser_for(column):
+    """Return a function turning a CSV field into a value for `column`.
+    Empty fields are NULL, as with COPY."""
+
+    python_type = column.type.python_type
+
+    if python_type is bool:
+        convert = lambda value: value == 'true'
+    elif python_type is datetime:
+        convert = datetime.fromisoformat
+    else:
+        convert = python_type
+
+    return lambda value: convert(value) if value != '' else None
+
+
+def insert_csv(table, path, chunk_size):
+    """Load a CSV (with a header row) into `table` with executemany INSERTs
+    of `chunk_size` rows."""
+
+    count = 0
+
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        columns = next(reader)
+        parsers = [parser_for(table.c[name]) for name in columns]
+
+        with db.engine.begin() as connection:
+            while True:
+                rows = [{name: parse(value)
+                         for name, parse, value in zip(columns, parsers, row)}
+                        for row in islice(reader, chunk_size)]
+                if not rows:
+                    break
+
+                connection.execute(table.insert(), rows)
+                count += len(rows)
+
+    return count
+
+
+def load(directory, chunk_size):
+    """Load every table's CSV from `directory`; returns {table: rows}."""
+
+    loaded = {}
+
+    for name in TABLES:
+        table = db.metadata.tables[name]
+        path = os.path.join(directory, f"{name}.csv")
+
+        if db.engine.dialect.name == "postgresql":
+            loaded[name] = copy_csv(table, path)
+        else:
+            loaded[name] = insert_csv(table, path, chunk_size)
+
+    loaded['conversations'] = Conversation.rebuild()
+    db.session.commit()
+
+    return loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dir", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        start = time.perf_counter()
+        loaded = load(args.dir, args.chunk_size)
+        elapsed = time.perf_counter() - start
+
+    for table, rows in loaded.items():
+        print(f"{table:>13}: {rows} rows")
+    print(f"loaded in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
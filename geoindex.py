@@ -0,0 +1,107 @@
+"""In-process spatial index over user locations."""
+
+import math
+import threading
+
+import numpy as np
+
+from zipcode import bounding_box, haversine, MI_TO_KM, KM_TO_MI
+
+
+class SpatialIndex():
+    """Grid bucket map of username -> (lat, lon).
+
+    The globe is cut into square cells of `cell_degrees`; a radius query only
+    looks at the cells overlapping the query's bounding box and then checks
+    the exact distance of those candidates in one vectorized pass.
+    """
+
+    def __init__(self, cell_degrees=0.5):
+        self.cell_degrees = cell_degrees
+        self.n_cols = math.ceil(360 / cell_degrees)
+        self.cells = {}
+        self.points = {}
+        self.built_at = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell(self, lat, lon):
+        row = math.floor((lat + 90) / self.cell_degrees)
+        col = math.floor((lon + 180) / self.cell_degrees) % self.n_cols
+        return row, col
+
+    def _add(self, username, lat, lon):
+        self._remove(username)
+
+        if math.isnan(lat) or math.isnan(lon):
+            return
+
+        cell = self._cell(lat, lon)
+        self.points[username] = (lat, lon, cell)
+        self.cells.setdefault(cell, set()).add(username)
+
+    def _remove(self, username):
+        point = self.points.pop(username, None)
+        if point is None:
+            return
+
+        bucket = self.cells[point[2]]
+        bucket.discard(username)
+        if not bucket:
+            del self.cells[point[2]]
+
+    def add(self, username, lat, lon):
+        """Add or move a user. Users with unknown (NaN) coordinates are
+        dropped from the index."""
+
+        with self._lock:
+            self._add(username, float(lat), float(lon))
+
+    def remove(self, username):
+        """Remove a user if present."""
+
+        with self._lock:
+            self._remove(username)
+
+    def rebuild(self, usernames, lats, lons, built_at=None):
+        """Replace the whole index with the given users."""
+
+        with self._lock:
+            self.cells = {}
+            self.points = {}
+            for username, lat, lon in zip(usernames, lats, lons):
+                self._add(username, float(lat), float(lon))
+            self.built_at = built_at
+
+    def query_radius(self, lat, lon, max_distance):
+        """Return {username: distance in miles} for every indexed user within
+        `max_distance` miles of (lat, lon)."""
+
+        if math.isnan(lat) or math.isnan(lon):
+            return {}
+
+        max_kilos = max_distance * MI_TO_KM
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, max_distance)
+
+        min_row, min_col = self._cell(min_lat, min_lon)
+        max_row, _ = self._cell(max_lat, max_lon)
+        n_cols = min(math.floor((max_lon + 180) / self.cell_degrees)
+                     - math.floor((min_lon + 180) / self.cell_degrees) + 1,
+                     self.n_cols)
+
+        with self._lock:
+            usernames = []
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, min_col + n_cols):
+                    usernames.extend(self.cells.get((row, col % self.n_cols), ()))
+
+            coords = np.array([self.points[name][:2] for name in usernames],
+                              dtype=float).reshape(-1, 2)
+
+        distances = haversine(lat, lon, coords[:, 0], coords[:, 1])
+        within = np.flatnonzero(distances <= max_kilos)
+
+        return {usernames[i]: round(float(distances[i]) * KM_TO_MI, 2)
+                for i in within}
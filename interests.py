@@ -0,0 +1,160 @@
+"""Hobby/interest similarity ranking.
+
+Users' hobbies and interests are tokenized into an in-memory inverted index
+(term -> document frequency, user -> term ids). Candidates are ranked by the
+TF-IDF cosine similarity of their terms to the user's, computed for the whole
+candidate list with a few NumPy passes.
+
+Rebuilds happen off the lock, so scoring keeps using the old index until the
+new one is swapped in.
+"""
+
+import re
+import threading
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from i in into is it its me my of on or
+    so the their to too very we with you your like love enjoy really also
+""".split())
+
+
+def tokenize(*texts):
+    """Return the set of lowercase word tokens in `texts`, without stopwords
+    and single characters. None is treated as empty."""
+
+    return {
+        token
+        for text in texts if text
+        for token in TOKEN_RE.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    }
+
+
+class InterestIndex():
+    """Inverted index over users' hobby/interest terms."""
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.df = np.zeros(1024, dtype=np.int64)
+        self.user_terms = {}
+        self.built_at = None
+        self._lock = threading.Lock()
+        # (username, terms or None) edits made while a rebuild runs
+        self._pending = None
+
+    def __len__(self):
+        return len(self.user_terms)
+
+    def _term_ids(self, terms, create=False):
+        ids = []
+        for term in terms:
+            term_id = self.vocabulary.get(term)
+            if term_id is None and create:
+                term_id = self.vocabulary[term] = len(self.vocabulary)
+                if term_id >= len(self.df):
+                    self.df = np.concatenate([self.df, np.zeros_like(self.df)])
+            if term_id is not None:
+                ids.append(term_id)
+        return np.array(sorted(ids), dtype=np.int64)
+
+    def _add(self, username, terms):
+        self._remove(username)
+
+        ids = self._term_ids(terms, create=True)
+        self.user_terms[username] = ids
+        self.df[ids] += 1
+
+    def _remove(self, username):
+        ids = self.user_terms.pop(username, None)
+        if ids is not None:
+            self.df[ids] -= 1
+
+    def add(self, username, *texts):
+        """Index (or re-index) a user's hobbies/interests text."""
+
+        terms = tokenize(*texts)
+        with self._lock:
+            self._add(username, terms)
+            if self._pending is not None:
+                self._pending.append((username, terms))
+
+    def remove(self, username):
+        with self._lock:
+            self._remove(username)
+            if self._pending is not None:
+                self._pending.append((username, None))
+
+    def start_rebuild(self):
+        """Claim the next rebuild; False if one is already running."""
+
+        with self._lock:
+            if self._pending is not None:
+                return False
+            self._pending = []
+            return True
+
+    def rebuild(self, rows, built_at=None):
+        """Replace the index with `rows` of (username, hobbies, interests).
+        Edits made while the new index is built are applied to it too."""
+
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+
+        try:
+            fresh = InterestIndex()
+            for username, *texts in rows:
+                fresh._add(username, tokenize(*texts))
+
+            with self._lock:
+                for username, terms in self._pending:
+                    if terms is None:
+                        fresh._remove(username)
+                    else:
+                        fresh._add(username, terms)
+                self.vocabulary = fresh.vocabulary
+                self.df = fresh.df
+                self.user_terms = fresh.user_terms
+                self.built_at = built_at
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def scores(self, terms, candidates):
+        """Return an array of TF-IDF cosine similarities between the term set
+        `terms` and each username in `candidates` (0 for unindexed users)."""
+
+        scores = np.zeros(len(candidates))
+
+        with self._lock:
+            query = self._term_ids(terms)
+            if not len(query) or not len(candidates):
+                return scores
+
+            empty = np.array([], dtype=np.int64)
+            doc_terms = [self.user_terms.get(username, empty) for username in candidates]
+
+            n_docs = max(len(self.user_terms), 1)
+            idf = np.log((1 + n_docs) / (1 + self.df[:len(self.vocabulary)])) + 1
+
+        lengths = np.fromiter(map(len, doc_terms), dtype=np.int64, count=len(doc_terms))
+        if not lengths.sum():
+            return scores
+
+        term_ids = np.concatenate(doc_terms)
+        doc_ids = np.repeat(np.arange(len(candidates)), lengths)
+        weights = idf[term_ids] ** 2
+
+        norms = np.bincount(doc_ids, weights=weights, minlength=len(candidates))
+        overlap = np.bincount(doc_ids, weights=weights * np.isin(term_ids, query),
+                              minlength=len(candidates))
+        query_norm = np.sqrt((idf[query] ** 2).sum())
+
+        nonzero = norms > 0
+        scores[nonzero] = overlap[nonzero] / (np.sqrt(norms[nonzero]) * query_norm)
+
+        return scores
@@ -0,0 +1,304 @@
+"""Request, SQL and external call metrics in the Prometheus text format.
+
+init_app(app) times every request by route, counts the SQL statements it
+runs and the time they take (a route whose statement count grows with the
+data is usually lazy loading in a loop), and serves everything on /metrics.
+instrument_s3(client) times S3 API calls; wrap other calls in
+external_seconds.time(service=..., operation=...).
+
+Metrics are kept per process: with several workers, each serves its own.
+Set SLOW_REQUEST_MS to log requests slower than that with the statements
+they ran.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+# statements kept per request for the slow request log
+MAX_LOGGED_STATEMENTS = 100
+
+
+def format_labels(labels):
+    """Return `labels` as {name="value",...}, escaped for the text format."""
+
+    if not labels:
+        return ""
+
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels)
+
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric():
+    """A named family of series, one per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        """Return the metric's lines in the text format."""
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+        with self._lock:
+            series = sorted(self._series.items())
+            for key, value in series:
+                lines.extend(self._render_series(list(zip(self.labelnames, key)), value))
+
+        return lines
+
+
+class Counter(Metric):
+    """Total that only goes up."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._series.get(self._key(labels), 0)
+
+    def _render_series(self, labels, value):
+        return [f"{self.name}{format_labels(labels)} {format_value(value)}"]
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative `buckets` (upper bounds), plus
+    their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [count per bucket..., sum]
+                series = self._series[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the with block takes, in seconds."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(self._key(labels))
+        return series[-2] if series else 0
+
+    def sum(self, **labels):
+        series = self._series.get(self._key(labels))
+        return series[-1] if series else 0.0
+
+    def _render_series(self, labels, series):
+        lines = [
+            "{}_bucket{} {}".format(
+                self.name, format_labels(labels + [("le", format_value(float(bound)))]), count)
+            for bound, count in zip(self.buckets, series)
+        ]
+        lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(series[-1])}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {series[-2]}")
+        return lines
+
+
+class Registry():
+    """The metrics /metrics serves."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+request_seconds = registry.register(Histogram(
+    "friender_request_duration_seconds", "Time to handle a request.",
+    ["method", "route", "status"]))
+
+request_statements = registry.register(Histogram(
+    "friender_request_sql_statements", "SQL statements run per request.",
+    ["route"], buckets=STATEMENT_BUCKETS))
+
+request_db_seconds = registry.register(Histogram(
+    "friender_request_db_seconds", "Time per request spent running SQL.",
+    ["route"]))
+
+slow_requests = registry.register(Counter(
+    "friender_slow_requests_total", "Requests slower than SLOW_REQUEST_MS.",
+    ["route"]))
+
+external_seconds = registry.register(Histogram(
+    "friender_external_call_duration_seconds",
+    "Time spent in calls to S3 and the zipcode table.",
+    ["service", "operation"]))
+
+
+class RequestStats():
+    """SQL run while handling the current request."""
+
+    def __init__(self, keep_statements):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.logged = [] if keep_statements else None
+        self.recorded = False
+
+
+def route_label():
+    """The matched url rule, so /api/users/<username> is one series."""
+
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_start"].pop()
+
+    if not has_request_context():
+        return
+    stats = g.get("metrics")
+    if stats is None:
+        return
+
+    stats.statements += 1
+    stats.db_seconds += elapsed
+    if stats.logged is not None and len(stats.logged) < MAX_LOGGED_STATEMENTS:
+        stats.logged.append((elapsed, statement))
+
+
+def start_request():
+    g.metrics = RequestStats(
+        keep_statements=current_app.config["SLOW_REQUEST_MS"] is not None)
+
+
+def record_request(status):
+    stats = g.get("metrics")
+    if stats is None or stats.recorded:
+        return
+    stats.recorded = True
+
+    elapsed = time.perf_counter() - stats.start
+    route = route_label()
+
+    request_seconds.observe(elapsed, method=request.method, route=route, status=status)
+    request_statements.observe(stats.statements, route=route)
+    request_db_seconds.observe(stats.db_seconds, route=route)
+
+    slow_ms = current_app.config["SLOW_REQUEST_MS"]
+    if slow_ms is not None and elapsed * 1000 >= slow_ms:
+        slow_requests.inc(route=route)
+        logger.warning(
+            "slow request: %s %s took %.1fms, %d statements in %.1fms\n%s",
+            request.method, request.path, elapsed * 1000, stats.statements,
+            stats.db_seconds * 1000,
+            "\n".join(f"  {seconds * 1000:.2f}ms {statement}"
+                      for seconds, statement in stats.logged))
+
+
+def metrics_view():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def init_app(app):
+    """Time the app's requests and serve /metrics."""
+
+    app.config.setdefault("SLOW_REQUEST_MS", None)
+
+    app.before_request(start_request)
+
+    @app.after_request
+    def after_request(response):
+        record_request(str(response.status_code))
+        return response
+
+    @app.teardown_request
+    def teardown_request(error):
+        # after_request doesn't run when a view raises
+        if error is not None:
+            record_request("500")
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+
+
+def instrument_s3(client):
+    """Time every API call `client` makes."""
+
+    def before_call(model, context, **kwargs):
+        context["metrics_start"] = time.perf_counter()
+
+    def after_call(model, context, **kwargs):
+        start = context.pop("metrics_start", None)
+        if start is not None:
+            external_seconds.observe(time.perf_counter() - start,
+                                     service="s3", operation=model.name)
+
+    client.meta.events.register("before-call.s3", before_call)
+    client.meta.events.register("after-call.s3", after_call)
+
+    return client
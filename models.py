@@ -1,12 +1,31 @@
 """SQLAlchemy models for Friender."""
 from flask import Flask
-from flask_bcrypt import Bcrypt
 
 from datetime import datetime
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+import numpy as np
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import hasher
+from replicas import RoutingSQLAlchemy
+from zipcode import Distance, bounding_box, haversine, MI_TO_KM, KM_TO_MI
+
+db = RoutingSQLAlchemy()
+
+
+def upsert(table, values, index_elements, set_):
+    """Build INSERT ... ON CONFLICT (index_elements) DO UPDATE for the
+    current database (Postgres, or SQLite locally and in tests).
+    `set_` is called with the `excluded` row to get the columns to update."""
+
+    insert = (postgresql.insert if db.engine.dialect.name == "postgresql"
+              else sqlite.insert)
+
+    statement = insert(table).values(values)
+
+    return statement.on_conflict_do_update(
+        index_elements=index_elements,
+        set_=set_(statement.excluded))
 
 
 class Images(db.Model):
@@ -14,6 +33,11 @@ class Images(db.Model):
 
     __tablename__ = 'images'
 
+    __table_args__ = (
+        db.Index('ix_images_username', 'username'),
+        db.Index('ix_images_filename', 'filename', unique=True),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True
@@ -34,6 +58,14 @@ class Images(db.Model):
         nullable=False
     )
 
+    variants = db.relationship(
+        "ImageVariant",
+        backref="image",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="ImageVariant.width"
+    )
+
     def to_dict(self):
 
         return {
@@ -43,6 +75,26 @@ class Images(db.Model):
             "filename": self.filename
         }
 
+    def pick_variant(self, width=None, webp=False):
+        """Return the smallest variant at least `width` px wide (the largest
+        if none is), preferring WebP when `webp` is set. None if the image
+        has no variants yet."""
+
+        formats = ("webp", "jpeg") if webp else ("jpeg",)
+
+        for format in formats:
+            variants = [variant for variant in self.variants if variant.format == format]
+            if not variants:
+                continue
+            if width is None:
+                return variants[-1]
+            for variant in variants:
+                if variant.width >= width:
+                    return variant
+            return variants[-1]
+
+        return None
+
     @classmethod
     def create_new_image(cls, username, path, filename):
         """Returns a class of a new image and returns it
@@ -59,11 +111,101 @@ class Images(db.Model):
         return image
 
 
+class ImageVariant(db.Model):
+    """A resized rendition of an uploaded image, stored next to it."""
+
+    __tablename__ = 'image_variants'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True
+    )
+
+    image_id = db.Column(
+        db.Integer,
+        db.ForeignKey('images.id', ondelete="cascade"),
+        nullable=False,
+        index=True
+    )
+
+    name = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    format = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    width = db.Column(
+        db.Integer,
+        nullable=False
+    )
+
+    height = db.Column(
+        db.Integer,
+        nullable=False
+    )
+
+    path = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    filename = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    def to_dict(self):
+
+        return {
+            "name": self.name,
+            "format": self.format,
+            "width": self.width,
+            "height": self.height,
+            "path": self.path
+        }
+
+
+class StorageDeletion(db.Model):
+    """An S3 object key waiting to be deleted by the storage worker."""
+
+    __tablename__ = 'storage_deletions'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True
+    )
+
+    key = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    enqueued_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    @classmethod
+    def enqueue(cls, keys):
+        """Queue object keys for deletion in the current transaction."""
+
+        db.session.bulk_insert_mappings(cls, [{"key": key} for key in keys])
+
+
 class Match(db.Model):
     """Connection of a user matching and the user being matched."""
 
     __tablename__ = 'matches'
 
+    __table_args__ = (
+        db.Index('ix_matches_user_following', 'user_following', 'user_being_followed'),
+    )
+
     user_being_followed = db.Column(
         db.String,
         db.ForeignKey('users.username', ondelete="cascade"),
@@ -95,12 +237,66 @@ class Match(db.Model):
         db.session.add(match)
         return match
 
+    @classmethod
+    def exists(cls, user_being_followed, user_following):
+        """Is there a match row from user_following to user_being_followed?"""
+
+        return db.session.query(cls.query.filter(
+            cls.user_being_followed == user_being_followed,
+            cls.user_following == user_following).exists()).scalar()
+
+    @classmethod
+    def mutual_matches(cls, username, candidates=None):
+        """Return the usernames `username` is mutually matched with (both
+        sides matched, neither unfriended), optionally only among
+        `candidates`. One self-join, each side a primary key lookup."""
+
+        reverse = db.aliased(cls)
+
+        query = (db.session.query(cls.user_following)
+                 .join(reverse, and_(
+                     reverse.user_being_followed == cls.user_following,
+                     reverse.user_following == cls.user_being_followed))
+                 .filter(cls.user_being_followed == username,
+                         cls.unfriended.is_(False),
+                         reverse.unfriended.is_(False)))
+
+        if candidates is not None:
+            query = query.filter(cls.user_following.in_(list(candidates)))
+
+        return [match_username for (match_username,) in query]
+
+    @classmethod
+    def record_swipes(cls, username, decisions):
+        """Record many swipes by `username` in one statement.
+        `decisions` maps match_username -> unfriended (False for a match,
+        True for an unmatch). Existing rows are updated, so repeating a swipe
+        is harmless."""
+
+        if not decisions:
+            return
+
+        table = cls.__table__
+
+        db.session.execute(upsert(
+            table,
+            [dict(user_being_followed=username,
+                  user_following=match_username,
+                  unfriended=unfriended)
+             for match_username, unfriended in decisions.items()],
+            index_elements=[table.c.user_being_followed, table.c.user_following],
+            set_=lambda excluded: dict(unfriended=excluded.unfriended)))
+
 
 class Message(db.Model):
     """An individual message."""
 
     __tablename__ = 'messages'
 
+    __table_args__ = (
+        db.Index('ix_messages_conversation_id', 'user_from', 'user_to', 'sent_at', 'id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True
@@ -124,7 +320,7 @@ class Message(db.Model):
     sent_at = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     @classmethod
@@ -137,8 +333,83 @@ class Message(db.Model):
             text = text
         )
 
+        db.session.add(message)
+        db.session.flush()
+        Conversation.record_message(message)
+
         return message
 
+    @classmethod
+    def conversation(cls, user_a, user_b, limit, before=None, after=None):
+        """Return up to `limit` messages between two users, oldest first.
+
+        `before`/`after` are message ids: with `before` the page is the newest
+        messages older than it, with `after` the oldest messages newer than it,
+        otherwise the newest messages. Raises ValueError for an unknown id
+        or if both are given.
+
+        Each direction is its own range scan of ix_messages_conversation_id,
+        bounded by the cursor's (sent_at, id), so a page costs the same
+        however long the conversation is."""
+
+        if before is not None and after is not None:
+            raise ValueError("pass before or after, not both")
+
+        cursor = None
+        if before is not None or after is not None:
+            cursor = cls.query.get(before if before is not None else after)
+            if cursor is None:
+                raise ValueError(f"no message {before or after}")
+
+        newest_first = after is None
+
+        def one_way(sender, recipient):
+            query = cls.query.filter(cls.user_from == sender,
+                                     cls.user_to == recipient)
+
+            position = tuple_(cls.sent_at, cls.id)
+            if cursor is not None and newest_first:
+                query = query.filter(position < tuple_(cursor.sent_at, cursor.id))
+            elif cursor is not None:
+                query = query.filter(position > tuple_(cursor.sent_at, cursor.id))
+
+            if newest_first:
+                query = query.order_by(cls.sent_at.desc(), cls.id.desc())
+            else:
+                query = query.order_by(cls.sent_at, cls.id)
+
+            return query.limit(limit).all()
+
+        messages = one_way(user_a, user_b)
+        if user_a != user_b:
+            messages += one_way(user_b, user_a)
+
+        messages.sort(key=lambda message: (message.sent_at, message.id),
+                      reverse=newest_first)
+
+        return sorted(messages[:limit],
+                      key=lambda message: (message.sent_at, message.id))
+
+    @classmethod
+    def since(cls, user_a, user_b, since_id, limit):
+        """Return up to `limit` messages between two users newer than message
+        `since_id`, oldest first. `since_id` needn't be a message between
+        them (0 for "from the start", or a deleted one); then newer means a
+        higher id."""
+
+        try:
+            return cls.conversation(user_a, user_b, limit, after=since_id)
+        except ValueError:
+            pass
+
+        return (cls.query
+                .filter(or_(and_(cls.user_from == user_a, cls.user_to == user_b),
+                            and_(cls.user_from == user_b, cls.user_to == user_a)),
+                        cls.id > since_id)
+                .order_by(cls.sent_at, cls.id)
+                .limit(limit)
+                .all())
+
     def __repr__(self):
         return f"<Message:\
         to: {self.user_to},\
@@ -156,11 +427,139 @@ class Message(db.Model):
         }
 
 
+class Conversation(db.Model):
+    """Per user inbox entry: the last message with a partner and how many
+    of the partner's messages are unread. Maintained by Message.add_message."""
+
+    __tablename__ = 'conversations'
+
+    __table_args__ = (
+        db.Index('ix_conversations_inbox', 'username', 'last_sent_at'),
+    )
+
+    username = db.Column(
+        db.String,
+        db.ForeignKey('users.username', ondelete="cascade"),
+        primary_key=True
+    )
+
+    partner = db.Column(
+        db.String,
+        db.ForeignKey('users.username', ondelete="cascade"),
+        primary_key=True
+    )
+
+    last_message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        nullable=False
+    )
+
+    last_sent_at = db.Column(
+        db.DateTime,
+        nullable=False
+    )
+
+    unread_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0
+    )
+
+    last_message = db.relationship("Message")
+
+    @classmethod
+    def record_message(cls, message):
+        """Point both sides' inbox entries at a new message. The recipient's
+        unread count goes up; sending a message marks the sender's side read."""
+
+        table = cls.__table__
+
+        for username, partner, unread in (
+                (message.user_from, message.user_to, 0),
+                (message.user_to, message.user_from, 1)):
+
+            if username == partner and unread:
+                continue
+
+            db.session.execute(upsert(
+                table,
+                dict(username=username,
+                     partner=partner,
+                     last_message_id=message.id,
+                     last_sent_at=message.sent_at,
+                     unread_count=unread),
+                index_elements=[table.c.username, table.c.partner],
+                set_=lambda excluded: dict(
+                    last_message_id=excluded.last_message_id,
+                    last_sent_at=excluded.last_sent_at,
+                    unread_count=(table.c.unread_count + 1 if unread else 0))))
+
+    @classmethod
+    def rebuild(cls):
+        """Replace every inbox entry with one built from the messages table,
+        in a single INSERT ... SELECT. Unread counts start at zero.
+        Returns the number of conversations."""
+
+        sides = db.union_all(
+            db.select(Message.user_from.label("username"),
+                      Message.user_to.label("partner"), Message.id),
+            db.select(Message.user_to, Message.user_from, Message.id),
+        ).subquery()
+
+        last = (db.select(sides.c.username, sides.c.partner,
+                          db.func.max(sides.c.id).label("last_message_id"))
+                .group_by(sides.c.username, sides.c.partner)
+                .subquery())
+
+        cls.query.delete()
+        result = db.session.execute(db.insert(cls.__table__).from_select(
+            ["username", "partner", "last_message_id", "last_sent_at", "unread_count"],
+            db.select(last.c.username, last.c.partner, last.c.last_message_id,
+                      Message.sent_at, db.literal(0))
+            .join(Message, Message.id == last.c.last_message_id)))
+
+        return result.rowcount
+
+    @classmethod
+    def inbox(cls, username, limit):
+        """Return a user's `limit` most recent conversations, newest first."""
+
+        return (cls.query
+                .options(db.joinedload(cls.last_message))
+                .filter(cls.username == username)
+                .order_by(cls.last_sent_at.desc())
+                .limit(limit)
+                .all())
+
+    @classmethod
+    def mark_read(cls, username, partner):
+        """Reset the unread count of one conversation."""
+
+        cls.query.filter(
+            cls.username == username,
+            cls.partner == partner,
+            cls.unread_count > 0).update({"unread_count": 0})
+
+    def to_dict(self):
+
+        return {
+            "partner": self.partner,
+            "last_message": self.last_message.to_dict(),
+            "last_sent_at": self.last_sent_at,
+            "unread_count": self.unread_count
+        }
+
+
 class User(db.Model):
     """User in the system."""
 
     __tablename__ = 'users'
 
+    __table_args__ = (
+        db.Index('ix_users_latitude_longitude', 'latitude', 'longitude'),
+    )
+
     username = db.Column(
         db.Text,
         primary_key=True,
@@ -201,6 +600,14 @@ class User(db.Model):
         default=50
     )
 
+    latitude = db.Column(
+        db.Float,
+    )
+
+    longitude = db.Column(
+        db.Float,
+    )
+
     messages = db.relationship(
         "Message",
         backref="users",
@@ -224,7 +631,8 @@ class User(db.Model):
     images = db.relationship(
         "Images",
         backref="users",
-        primaryjoin=(Images.username == username)
+        primaryjoin=(Images.username == username),
+        passive_deletes=True
     )
 
     # matches = db.relationship(
@@ -246,29 +654,88 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Match.exists(self.username, other_user.username)
 
     def is_following(self, other_user):
         """Is this user following `other_user`?"""
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return Match.exists(other_user.username, self.username)
+
+    def is_mutual_match(self, other_user):
+        """Are this user and `other_user` matched with each other?"""
+
+        return bool(Match.mutual_matches(self.username, [other_user.username]))
+
+    def set_location(self, location):
+        """Set the user's zipcode and geocode it to latitude/longitude.
+        Unknown zipcodes leave the coordinates empty."""
+
+        [lat], [lon] = Distance.get_coordinates([location])
+
+        self.location = location
+        self.latitude = None if np.isnan(lat) else float(lat)
+        self.longitude = None if np.isnan(lon) else float(lon)
+
+    @classmethod
+    def find_candidates(cls, user):
+        """Return (usernames, distances in miles) arrays of users `user` can be
+        shown: each within the other's friend_radius, excluding anyone `user`
+        already matched or unmatched and anyone who unfriended `user`.
+
+        A bounding box prefilter runs in SQL against the latitude/longitude
+        index together with the match anti-joins, then exact and mutual
+        distances are checked in one vectorized pass."""
+
+        lat, lon = user.latitude, user.longitude
+        max_distance = int(user.friend_radius)
+
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, max_distance)
+
+        in_longitude = cls.longitude.between(min_lon, max_lon)
+        if min_lon < -180:
+            in_longitude = or_(in_longitude, cls.longitude >= min_lon + 360)
+        if max_lon > 180:
+            in_longitude = or_(in_longitude, cls.longitude <= max_lon - 360)
+
+        swiped = (Match.query
+                  .filter(Match.user_being_followed == user.username,
+                          Match.user_following == cls.username)
+                  .exists())
+
+        unfriended_by = (Match.query
+                         .filter(Match.user_being_followed == cls.username,
+                                 Match.user_following == user.username,
+                                 Match.unfriended.is_(True))
+                         .exists())
+
+        rows = (db.session.query(cls.username, cls.latitude, cls.longitude,
+                                 cls.friend_radius)
+                .filter(cls.latitude.between(min_lat, max_lat), in_longitude,
+                        cls.username != user.username,
+                        ~swiped,
+                        ~unfriended_by)
+                .all())
+
+        usernames = np.array([row[0] for row in rows], dtype=object)
+        coords = np.array([row[1:] for row in rows], dtype=float).reshape(-1, 3)
+
+        distances = haversine(lat, lon, coords[:, 0], coords[:, 1])
+        within = distances <= np.minimum(max_distance, coords[:, 2]) * MI_TO_KM
+
+        return usernames[within], np.round(distances[within] * KM_TO_MI, 2)
 
     @classmethod
     def signup(cls, username, email, password, location):
         """Sign up user, hashes password, and adds user to database."""
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
             email=email,
             password=hashed_pwd,
-            location=location
         )
+        user.set_location(location)
 
         db.session.add(user)
 
@@ -276,12 +743,16 @@ class User(db.Model):
 
     @classmethod
     def authenticate(cls, username, password):
-        """Return authenticated user or False."""
+        """Return authenticated user or False.
+        A password hashed with an outdated cost is rehashed; the caller
+        commits it."""
 
         user = cls.query.get(username)
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -0,0 +1,68 @@
+"""Keyset pagination helpers for Friender."""
+
+import base64
+import binascii
+import json
+
+import numpy as np
+
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(*key):
+    """Encode a sort key as an opaque, url-safe cursor string."""
+
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor back to its sort key list.
+    Raises ValueError for anything that isn't one of our cursors."""
+
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError(f"invalid cursor {cursor!r}")
+
+    if not isinstance(key, list):
+        raise ValueError(f"invalid cursor {cursor!r}")
+
+    return key
+
+
+def get_limit(value, default=20):
+    """Parse a `limit` query parameter, clamped to 1..MAX_PAGE_SIZE."""
+
+    if value is None:
+        return default
+
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+
+def nearest_page(distances, names, limit, after=None):
+    """given parallel arrays of distances and names return the indices of the
+    `limit` smallest (distance, name) keys strictly after the key `after`,
+    in order.
+
+    Uses a partial selection (np.partition), so only the page itself and
+    any distance ties at its edge get sorted, not the whole candidate set."""
+
+    distances = np.asarray(distances, dtype=float)
+    names = np.asarray(names, dtype=object)
+    candidates = np.arange(len(distances))
+
+    if after is not None:
+        after_distance, after_name = after
+        later = ((distances > after_distance)
+                 | ((distances == after_distance) & (names > after_name)))
+        candidates = candidates[later]
+
+    if len(candidates) > limit:
+        # everything strictly closer than the limit-th distance is in the page;
+        # whoever ties with it competes on name below
+        cutoff = np.partition(distances[candidates], limit - 1)[limit - 1]
+        candidates = candidates[distances[candidates] <= cutoff]
+
+    page = sorted(candidates, key=lambda i: (distances[i], names[i]))
+
+    return page[:limit]
@@ -0,0 +1,85 @@
+"""Password hashing for Friender.
+
+bcrypt runs on a process pool so a login storm uses every core, and the
+number of hashes waiting for the pool is bounded so callers block instead
+of piling up. The cost factor is configurable; hashes made with another
+cost are reported by needs_rehash() so they can be upgraded on login.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+def get_rounds(hashed):
+    """Return the cost factor of a bcrypt hash ($2b$12$... -> 12)."""
+
+    return int(hashed.split("$")[2])
+
+
+class PasswordHasher():
+    """bcrypt on a bounded process pool.
+
+    `workers` processes (default: one per core) are started on first use, so
+    each forked server worker gets its own pool. workers=0 hashes on the
+    calling thread. At most `workers * 2` hashes wait for the pool at once.
+    """
+
+    def __init__(self, rounds=12, workers=None):
+        self.configure(rounds, workers)
+
+    def configure(self, rounds=12, workers=None):
+        self.rounds = rounds
+        self.workers = os.cpu_count() if workers is None else workers
+        self.shutdown()
+
+    def shutdown(self):
+        pool = getattr(self, "_pool", None)
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+        self._pool = None
+        self._pool_pid = None
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) * 2)
+        self._lock = threading.Lock()
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(self.workers)
+                self._pool_pid = os.getpid()
+            pool = self._pool
+
+        with self._slots:
+            return pool.submit(func, *args).result()
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` at the configured cost."""
+
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        """Does `password` match the bcrypt hash `hashed`?"""
+
+        return self._run(_check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different cost than the configured one?"""
+
+        return get_rounds(hashed) != self.rounds
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,138 @@
+"""Publish/subscribe for pushing events to connected clients.
+
+Broker delivers within the current process. RedisBroker relays through Redis
+pub/sub so a publish in one worker reaches subscribers in every worker; each
+worker keeps a single Redis connection and fans out to its own subscribers.
+If that connection drops the worker reconnects with backoff; payloads
+published meanwhile are missed, and clients catch up with Last-Event-ID.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription():
+    """A subscriber's queue of payloads on one channel."""
+
+    def __init__(self, broker, channel, maxsize=100):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout=None):
+        """Return the next payload, or None if nothing arrives in `timeout`
+        seconds."""
+
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker():
+    """In-process broker."""
+
+    def __init__(self):
+        self.subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """Start receiving payloads published to `channel`."""
+
+        subscription = Subscription(self, channel)
+
+        with self._lock:
+            self.subscriptions.setdefault(channel, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self.subscriptions.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self.subscriptions.pop(subscription.channel, None)
+
+    def publish(self, channel, payload):
+        """Send a string payload to every subscriber of `channel`."""
+
+        self.deliver(channel, payload)
+
+    def deliver(self, channel, payload):
+        """Hand a payload to this process's subscribers of `channel`.
+        A subscriber that has fallen `maxsize` payloads behind drops it."""
+
+        with self._lock:
+            subscribers = list(self.subscriptions.get(channel, ()))
+
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(payload)
+            except queue.Full:
+                pass
+
+
+class RedisBroker(Broker):
+    """Broker that relays publishes through Redis to every worker.
+    Needs the `redis` package, unless given a `client`."""
+
+    # seconds between reconnects, doubling up to the maximum
+    reconnect_delay = 0.5
+    max_reconnect_delay = 30
+
+    def __init__(self, url, prefix="friender:", client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+
+        super().__init__()
+        self.prefix = prefix
+        self.client = client
+
+        self.listener = threading.Thread(target=self._listen, daemon=True)
+        self.listener.start()
+
+    def publish(self, channel, payload):
+        self.client.publish(self.prefix + channel, payload)
+
+    def _listen(self):
+        delay = self.reconnect_delay
+
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + "*")
+                delay = self.reconnect_delay
+
+                for event in pubsub.listen():
+                    channel = event["channel"].decode()[len(self.prefix):]
+                    self.deliver(channel, event["data"].decode())
+            except Exception:
+                logger.exception("redis subscription failed, reconnecting in %gs", delay)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+
+def make_broker(url=None):
+    """Return a RedisBroker for a redis:// url, otherwise an in-process
+    Broker."""
+
+    if url and url.startswith(("redis://", "rediss://")):
+        return RedisBroker(url)
+
+    return Broker()
@@ -0,0 +1,172 @@
+"""Send read-only requests to a read replica.
+
+Set REPLICA_DATABASE_URL and views wrapped in @use_replica run their reads
+on the "replica" bind. Everything else, and any INSERT/UPDATE/DELETE or
+flush even inside those views, goes to the primary.
+
+Replicas lag, so after a request in which a user wrote something, that
+user's reads stay on the primary for REPLICA_STICKY_SECONDS. Workers share
+the list of recent writers through Redis (REPLICA_STICKY_URL, by default
+PUBSUB_URL); without Redis each worker only knows its own users' writes,
+which only holds with a single worker.
+
+Per-worker caches must not undo this: a request reading from the replica
+doesn't fill them, and a recent writer doesn't read from them (see
+may_fill_cache and may_read_cache).
+"""
+
+import logging
+from functools import wraps
+
+from flask import current_app, g, has_request_context
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = "replica"
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from the replica when the request allows it."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context():
+            if self._flushing or isinstance(clause, UpdateBase):
+                g.db_wrote = True
+            elif g.get("use_replica"):
+                return get_state(self.app).db.get_engine(self.app, bind=REPLICA_BIND)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose sessions are RoutingSessions."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class LocalWrites():
+    """Users who wrote in the last `ttl` seconds, in this process."""
+
+    def __init__(self, ttl, maxsize=100000):
+        self.writers = LRUCache(maxsize, ttl)
+
+    def mark(self, identity):
+        self.writers.set(identity, True)
+
+    def __contains__(self, identity):
+        return identity in self.writers
+
+    def clear(self):
+        self.writers.clear()
+
+
+class RedisWrites():
+    """Users who wrote in the last `ttl` seconds, shared by every worker
+    through expiring Redis keys. If Redis can't be reached, everyone counts
+    as a recent writer, so reads fall back to the primary."""
+
+    def __init__(self, client, ttl, prefix="friender:wrote:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def mark(self, identity):
+        try:
+            self.client.set(self.prefix + identity, 1, ex=self.ttl)
+        except Exception:
+            logger.exception("recording a write for %s failed", identity)
+
+    def __contains__(self, identity):
+        try:
+            return bool(self.client.exists(self.prefix + identity))
+        except Exception:
+            logger.exception("checking recent writes failed, reading from the primary")
+            return True
+
+
+def make_recent_writes(url, ttl):
+    """Return RedisWrites for a redis:// url, otherwise LocalWrites.
+    RedisWrites needs the `redis` package."""
+
+    if url and url.startswith(("redis://", "rediss://")):
+        import redis
+        return RedisWrites(redis.Redis.from_url(url), ttl)
+
+    return LocalWrites(ttl)
+
+
+def has_replica(app):
+    return REPLICA_BIND in (app.config.get("SQLALCHEMY_BINDS") or {})
+
+
+def current_identity():
+    """The request's JWT identity, or None if it has none."""
+
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+
+def mark_write(identity):
+    """Keep `identity`'s reads on the primary for a while."""
+
+    if identity is not None and has_replica(current_app):
+        current_app.extensions["replicas"].mark(str(identity))
+
+
+def use_replica(view):
+    """Run the view's reads on the replica, unless the requesting user
+    wrote something recently. Goes below @jwt_required()."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if has_replica(current_app):
+            identity = current_identity()
+            g.recent_writer = (identity is not None
+                               and str(identity) in current_app.extensions["replicas"])
+            g.use_replica = not g.recent_writer
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def may_read_cache():
+    """May this request serve from per-worker caches? Not for a user who
+    wrote recently: another worker's cache may predate the write."""
+
+    return not g.get("recent_writer")
+
+
+def may_fill_cache():
+    """May this request cache what it read? Not if it read from the
+    replica, which may lag behind writes other users will expect to see."""
+
+    return not g.get("use_replica")
+
+
+def init_app(app):
+    """Track which users wrote recently."""
+
+    app.config.setdefault("REPLICA_STICKY_SECONDS", 10)
+    app.config.setdefault("REPLICA_STICKY_URL", None)
+
+    url = app.config["REPLICA_STICKY_URL"] or app.config.get("PUBSUB_URL")
+    app.extensions["replicas"] = make_recent_writes(url, app.config["REPLICA_STICKY_SECONDS"])
+
+    if has_replica(app) and isinstance(app.extensions["replicas"], LocalWrites):
+        logger.warning("recent writes are tracked per worker; with several workers "
+                       "set REPLICA_STICKY_URL (or PUBSUB_URL) to a redis:// url")
+
+    @app.after_request
+    def after_request(response):
+        if g.get("db_wrote"):
+            mark_write(current_identity())
+        return response
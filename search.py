@@ -0,0 +1,119 @@
+"""Full-text user search over bio, hobbies and interests.
+
+Postgres uses a GIN index on a to_tsvector() expression over the three
+columns. SQLite (local runs and tests) uses an FTS5 table that triggers keep
+in sync with users. Both are created right after the users table, and the
+FTS table is dropped with it; use create_search_index() for databases that
+already have one.
+"""
+
+import re
+
+from sqlalchemy import DDL, bindparam, event, text
+
+from models import db, User
+
+TOKEN_RE = re.compile(r"\w+")
+
+DOCUMENT = ("to_tsvector('english', coalesce(bio, '') || ' ' || "
+            "coalesce(hobbies, '') || ' ' || coalesce(interests, ''))")
+
+POSTGRES_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_users_search ON users USING GIN ({DOCUMENT})",
+]
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS users_fts
+       USING fts5(username UNINDEXED, bio, hobbies, interests,
+                  tokenize = 'porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+           INSERT INTO users_fts (username, bio, hobbies, interests)
+           VALUES (new.username, new.bio, new.hobbies, new.interests);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE ON users BEGIN
+           DELETE FROM users_fts WHERE username = old.username;
+           INSERT INTO users_fts (username, bio, hobbies, interests)
+           VALUES (new.username, new.bio, new.hobbies, new.interests);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+           DELETE FROM users_fts WHERE username = old.username;
+       END""",
+]
+
+POSTGRES_SEARCH = f"""
+    SELECT username, ts_rank({DOCUMENT}, query) AS rank
+    FROM users, plainto_tsquery('english', :query) AS query
+    WHERE {DOCUMENT} @@ query {{restrict}}
+    ORDER BY rank DESC, username
+    LIMIT :limit OFFSET :offset
+"""
+
+SQLITE_SEARCH = """
+    SELECT username, -bm25(users_fts) AS rank
+    FROM users_fts
+    WHERE users_fts MATCH :query {restrict}
+    ORDER BY rank DESC, username
+    LIMIT :limit OFFSET :offset
+"""
+
+for statement in POSTGRES_DDL:
+    event.listen(User.__table__, "after_create",
+                 DDL(statement).execute_if(dialect="postgresql"))
+
+for statement in SQLITE_DDL:
+    event.listen(User.__table__, "after_create",
+                 DDL(statement).execute_if(dialect="sqlite"))
+
+# the triggers go with the users table, the FTS table doesn't
+event.listen(User.__table__, "before_drop",
+             DDL("DROP TABLE IF EXISTS users_fts").execute_if(dialect="sqlite"))
+
+
+def create_search_index():
+    """Create the search index on an existing users table, filling the
+    SQLite FTS table from the current rows."""
+
+    if db.engine.dialect.name == "postgresql":
+        for statement in POSTGRES_DDL:
+            db.session.execute(text(statement))
+    else:
+        for statement in SQLITE_DDL:
+            db.session.execute(text(statement))
+        db.session.execute(text("DELETE FROM users_fts"))
+        db.session.execute(text(
+            """INSERT INTO users_fts (username, bio, hobbies, interests)
+               SELECT username, bio, hobbies, interests FROM users"""))
+
+    db.session.commit()
+
+
+def search_users(query, limit, offset=0, usernames=None):
+    """Return [(username, rank), ...] of users whose bio, hobbies or
+    interests match every word of `query`, most relevant first.
+    Pass `usernames` to only search among those users."""
+
+    words = TOKEN_RE.findall(query)
+    if not words or (usernames is not None and not len(usernames)):
+        return []
+
+    params = {"limit": limit, "offset": offset}
+
+    if db.engine.dialect.name == "postgresql":
+        sql = POSTGRES_SEARCH
+        params["query"] = " ".join(words)
+    else:
+        sql = SQLITE_SEARCH
+        # quote every word so user input can't use FTS5 query syntax
+        params["query"] = " ".join(f'"{word}"' for word in words)
+
+    restrict = ""
+    if usernames is not None:
+        restrict = "AND username IN :usernames"
+        params["usernames"] = list(usernames)
+
+    statement = text(sql.format(restrict=restrict))
+    if usernames is not None:
+        statement = statement.bindparams(bindparam("usernames", expanding=True))
+
+    return [(username, float(rank))
+            for username, rank in db.session.execute(statement, params)]
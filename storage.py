@@ -0,0 +1,197 @@
+"""S3 storage for user photos.
+
+Photos are uploaded straight from the client to S3 with a presigned PUT URL;
+the API only signs the URL and, once the client reports the upload done,
+checks the object and records it. Point S3_ENDPOINT_URL at a local S3
+stand-in (MinIO, moto) for development and tests.
+
+Objects are never deleted inside a request: their keys go on the
+storage_deletions queue in the same transaction that removes the rows, and
+drain_deletions() empties it with batched delete_objects calls.
+reconcile_storage() queues objects no row refers to.
+"""
+
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from models import db, Images, ImageVariant, StorageDeletion
+
+logger = logging.getLogger(__name__)
+
+PHOTO_CONTENT_TYPE = "image/jpeg"
+
+# delete_objects takes at most 1000 keys per call
+MAX_DELETE_BATCH = 1000
+
+
+def make_s3_client(config):
+    """Return a boto3 S3 client for the app config."""
+
+    # boto3 takes a noticeable share of startup; only load it once needed
+    import boto3
+
+    return boto3.client(
+        's3',
+        aws_access_key_id=config['S3_KEY'],
+        aws_secret_access_key=config['S3_SECRET'],
+        endpoint_url=config.get('S3_ENDPOINT_URL'),
+        region_name=config.get('S3_REGION'),
+    )
+
+
+def new_photo_key(username):
+    """Return a fresh object key for one of `username`'s photos."""
+
+    return f"{username}/{uuid.uuid4().hex}"
+
+
+def is_photo_key(username, key):
+    """Could `key` have come from new_photo_key(username)? False for
+    anything that isn't a string."""
+
+    if not isinstance(key, str):
+        return False
+
+    prefix, _, name = key.partition("/")
+    return prefix == username and len(name) == 32 and name.isalnum()
+
+
+def presign_upload(s3, bucket, key, expires_in):
+    """Return a URL the client can PUT the photo bytes to for `expires_in`
+    seconds. The PUT must send the same Content-Type."""
+
+    return s3.generate_presigned_url(
+        'put_object',
+        Params={'Bucket': bucket, 'Key': key, 'ContentType': PHOTO_CONTENT_TYPE},
+        ExpiresIn=expires_in,
+    )
+
+
+def get_object_info(s3, bucket, key):
+    """Return the object's head (ContentLength, ContentType, ...) or None if
+    it doesn't exist."""
+
+    try:
+        return s3.head_object(Bucket=bucket, Key=key)
+    except s3.exceptions.ClientError as error:
+        if error.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def object_keys_for_user(username):
+    """Return the keys of every stored object (originals and variants) of a
+    user's photos."""
+
+    originals = db.session.query(Images.filename).filter(Images.username == username)
+    variants = (db.session.query(ImageVariant.filename)
+                .join(Images, Images.id == ImageVariant.image_id)
+                .filter(Images.username == username))
+
+    return [key for (key,) in originals.union_all(variants)]
+
+
+def drain_deletions(s3, bucket, batch_size=MAX_DELETE_BATCH):
+    """Delete queued keys from S3 with batched delete_objects calls until the
+    queue is empty. Keys S3 fails to delete stay queued for the next run.
+    Returns the number of keys deleted.
+
+    On Postgres, rows are claimed with SKIP LOCKED, so several workers can
+    drain at once without deleting the same keys twice."""
+
+    deleted = 0
+
+    while True:
+        rows = (StorageDeletion.query
+                .order_by(StorageDeletion.id)
+                .limit(min(batch_size, MAX_DELETE_BATCH))
+                .with_for_update(skip_locked=True)
+                .all())
+        if not rows:
+            db.session.commit()
+            return deleted
+
+        response = s3.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in {row.key for row in rows}],
+                    "Quiet": True},
+        )
+        failed = {error["Key"] for error in response.get("Errors", [])}
+
+        for row in rows:
+            if row.key not in failed:
+                db.session.delete(row)
+                deleted += 1
+
+        db.session.commit()
+
+        if failed and len(failed) == len({row.key for row in rows}):
+            logger.error("S3 refused to delete %s queued keys", len(failed))
+            return deleted
+
+
+def find_orphans(s3, bucket, min_age=timedelta(days=1)):
+    """Yield keys in the bucket that no Images or ImageVariant row refers to.
+    Objects younger than `min_age` are skipped, since presigned uploads exist
+    in S3 before their Images row is recorded."""
+
+    cutoff = datetime.now(timezone.utc) - min_age
+    paginator = s3.get_paginator("list_objects_v2")
+
+    for page in paginator.paginate(Bucket=bucket, PaginationConfig={"PageSize": 1000}):
+        keys = [obj["Key"] for obj in page.get("Contents", ())
+                if obj["LastModified"] < cutoff]
+        if not keys:
+            continue
+
+        known = {key for (key,) in db.session.query(Images.filename)
+                 .filter(Images.filename.in_(keys))}
+        known.update(key for (key,) in db.session.query(ImageVariant.filename)
+                     .filter(ImageVariant.filename.in_(keys)))
+
+        yield from (key for key in keys if key not in known)
+
+
+def reconcile_storage(s3, bucket, min_age=timedelta(days=1)):
+    """Queue every orphaned object in the bucket for deletion.
+    Returns the number of keys queued."""
+
+    queued = {key for (key,) in db.session.query(StorageDeletion.key)}
+    orphans = [key for key in find_orphans(s3, bucket, min_age) if key not in queued]
+
+    for start in range(0, len(orphans), MAX_DELETE_BATCH):
+        StorageDeletion.enqueue(orphans[start:start + MAX_DELETE_BATCH])
+        db.session.commit()
+
+    return len(orphans)
+
+
+class DeletionWorker():
+    """Daemon thread draining the deletion queue every `interval` seconds."""
+
+    def __init__(self, interval=30):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, app, s3):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, args=(app, s3), daemon=True, name="storage-deletions")
+            self._thread.start()
+
+    def _run(self, app, s3):
+        while not self._stop.wait(self.interval):
+            with app.app_context():
+                try:
+                    drain_deletions(s3, app.config['S3_BUCKET'])
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("draining storage deletions failed")
+                finally:
+                    db.session.remove()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,51 @@
+"""LRU cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_cache.py
+
+
+import time
+from unittest import TestCase
+
+from cache import LRUCache
+
+
+class LRUCacheTestCase(TestCase):
+    """Test size and age based eviction."""
+
+    def test_lru_eviction(self):
+        """The least recently used entry goes first."""
+
+        evicted = []
+        cache = LRUCache(2, on_evict=lambda key, value: evicted.append(key))
+
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(evicted, ["b"])
+        self.assertEqual(cache.keys(), ["a", "c"])
+
+    def test_ttl(self):
+        """Entries older than the ttl are misses."""
+
+        cache = LRUCache(2, ttl=0.01)
+        cache.set("a", 1)
+
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_pop(self):
+        """pop removes without calling on_evict."""
+
+        evicted = []
+        cache = LRUCache(2, on_evict=lambda key, value: evicted.append(key))
+        cache.set("a", 1)
+
+        self.assertEqual(cache.pop("a"), 1)
+        self.assertIsNone(cache.pop("a"))
+        self.assertEqual(evicted, [])
@@ -0,0 +1,104 @@
+"""Candidate deck tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_candidates.py
+
+
+from models import db, Match, User
+from testing import DatabaseTestCase, use_test_zipcodes
+from zipcode import haversine, KM_TO_MI
+
+# username: (zipcode or (latitude, longitude), friend_radius)
+USERS = {
+    "alice": ("10001", 50),
+    "bob": ("11201", 50),
+    "carol": ("11201", 2),
+    "dave": ("02139", 500),
+    "erin": ("10001", 50),
+    "frank": ("10001", 50),
+    "gina": ("10001", 50),
+    "henry": ("94103", 3000),
+    "nowhere": ("99999", 50),
+    # either side of the antimeridian
+    "ivan": ((-17.7, 179.9), 100),
+    "jack": ((-17.7, -179.9), 100),
+    "kim": ((-17.7, 179.0), 100),
+}
+
+
+class FindCandidatesTestCase(DatabaseTestCase):
+    """Test User.find_candidates against checking every user."""
+
+    def setUp(self):
+        """Create the users, with some swipes between them."""
+
+        super().setUp()
+        use_test_zipcodes(self)
+
+        for username, (location, radius) in USERS.items():
+            user = User(username=username, email=f"{username}@test.com",
+                        password="HASHED_PASSWORD", friend_radius=radius)
+            if isinstance(location, str):
+                user.set_location(location)
+            else:
+                user.location = "00000"
+                user.latitude, user.longitude = location
+            db.session.add(user)
+        db.session.commit()
+
+        Match.record_swipes("alice", {"erin": False, "henry": True})
+        Match.record_swipes("frank", {"alice": True})
+        Match.record_swipes("gina", {"alice": False})
+        Match.record_swipes("jack", {"ivan": True})
+        db.session.commit()
+
+    def brute_force(self, user):
+        """{username: miles} of the users `user` should be shown."""
+
+        swiped = {match.user_following for match in
+                  Match.query.filter_by(user_being_followed=user.username)}
+        unfriended_by = {match.user_being_followed for match in
+                         Match.query.filter_by(user_following=user.username, unfriended=True)}
+
+        found = {}
+        for other in User.query:
+            if (other.username == user.username or other.latitude is None
+                    or other.username in swiped or other.username in unfriended_by):
+                continue
+            miles = haversine(user.latitude, user.longitude,
+                              other.latitude, other.longitude) * KM_TO_MI
+            if miles <= min(user.friend_radius, other.friend_radius):
+                found[other.username] = miles
+
+        return found
+
+    def candidates(self, username):
+        usernames, distances = User.find_candidates(User.query.get(username))
+        return dict(zip(usernames, distances))
+
+    def test_matches_brute_force(self):
+        """Every user's deck is what checking each user by hand gives."""
+
+        for user in User.query.filter(User.latitude.isnot(None)):
+            expected = self.brute_force(user)
+            found = self.candidates(user.username)
+
+            self.assertEqual(sorted(found), sorted(expected), user.username)
+            for username, miles in expected.items():
+                self.assertAlmostEqual(found[username], miles, delta=0.01)
+
+    def test_exclusions(self):
+        """Swiped users, users who unmatched, users out of either radius
+        and users without a location are left out."""
+
+        self.assertEqual(sorted(self.candidates("alice")), ["bob", "gina"])
+        self.assertEqual(sorted(self.candidates("dave")), [])
+        self.assertEqual(sorted(self.candidates("henry")), [])
+
+    def test_antimeridian(self):
+        """Users across the antimeridian are found, unless they unmatched."""
+
+        self.assertEqual(sorted(self.candidates("jack")), ["kim"])
+        self.assertEqual(sorted(self.candidates("kim")), ["ivan", "jack"])
+        self.assertEqual(sorted(self.candidates("ivan")), ["kim"])
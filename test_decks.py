@@ -0,0 +1,151 @@
+"""Candidate deck cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_decks.py
+
+
+from unittest import TestCase
+
+import numpy as np
+from flask_jwt_extended import create_access_token
+
+from decks import DeckCache
+from models import db, User
+from testing import DatabaseTestCase, make_api_app, use_test_zipcodes
+
+app = make_api_app()
+
+# username: (zipcode, friend_radius); 10001 and 11201 are ~4 miles apart,
+# 02139 ~190 miles from them and 94103 across the country
+USERS = {
+    "alice": ("10001", 50),
+    "bob": ("11201", 50),
+    "carol": ("10001", 5),
+    "dave": ("02139", 50),
+    "erin": ("94103", 50),
+}
+
+
+class Owner():
+    """Stand-in for a User, with what DeckCache looks at."""
+
+    def __init__(self, username, latitude, longitude, friend_radius):
+        self.username = username
+        self.latitude = latitude
+        self.longitude = longitude
+        self.friend_radius = friend_radius
+
+
+class DeckCacheTestCase(TestCase):
+    """Test the cache on its own."""
+
+    def setUp(self):
+        self.decks = DeckCache()
+        self.alice = Owner("alice", 40.75, -74.0, 50)
+        self.decks.set(self.alice, np.array(["bob"], dtype=object), np.array([3.8]))
+
+    def test_get(self):
+        """A deck is a hit for the same location and radius only."""
+
+        usernames, distances = self.decks.get(self.alice)
+        self.assertEqual(list(usernames), ["bob"])
+        self.assertFalse(distances.flags.writeable)
+
+        self.assertIsNone(self.decks.get(Owner("alice", 40.75, -74.0, 10)))
+        self.assertIsNone(self.decks.get(self.alice))
+
+        self.decks.set(self.alice, np.array([], dtype=object), np.array([]))
+        self.assertIsNone(self.decks.get(Owner("alice", 42.36, -71.1, 50)))
+
+    def test_invalidate_near(self):
+        """Only decks whose owner's own radius reaches the point are dropped."""
+
+        self.decks.set(Owner("carol", 40.75, -74.0, 5), np.array([], dtype=object), np.array([]))
+        self.decks.invalidate_near(None, None)
+        self.assertEqual(self.decks.decks.keys(), ["alice", "carol"])
+
+        self.decks.invalidate_near(40.45, -74.0)    # ~21 miles away
+        self.assertEqual(self.decks.decks.keys(), ["carol"])
+
+        self.decks.invalidate_near(40.69, -73.99)   # ~4 miles away
+        self.assertEqual(self.decks.decks.keys(), [])
+
+
+class DeckInvalidationTestCase(DatabaseTestCase):
+    """Test that each route drops exactly the decks it affects."""
+
+    app = app
+
+    def setUp(self):
+        """Create the users and cache everyone's deck."""
+
+        super().setUp()
+        use_test_zipcodes(self)
+
+        for username, (location, radius) in USERS.items():
+            user = User(username=username, email=f"{username}@test.com",
+                        password="HASHED_PASSWORD", friend_radius=radius)
+            user.set_location(location)
+            db.session.add(user)
+        db.session.commit()
+
+        self.tokens = {username: create_access_token(identity=username)
+                       for username in USERS}
+        self.detach()
+
+        self.client = app.test_client()
+        for username in USERS:
+            self.client.get("/api/users?limit=100", headers=self.headers(username))
+
+        self.decks = app.extensions["friender"]["decks"]
+        self.assertEqual(self.cached(), set(USERS))
+
+    def tearDown(self):
+        self.decks.clear()
+        super().tearDown()
+
+    def headers(self, username):
+        return {"Authorization": "Bearer " + self.tokens[username]}
+
+    def cached(self):
+        return set(self.decks.decks.keys())
+
+    def test_signup(self):
+        """A new user drops the decks of users whose radius reaches them."""
+
+        self.client.post("/api/signup", json={"username": "frank", "email": "frank@test.com",
+                                              "password": "password", "location": "11201"})
+        self.assertEqual(self.cached(), {"dave", "erin"})
+
+    def test_move(self):
+        """Moving drops the mover's deck and those near both locations."""
+
+        self.client.patch("/api/users/carol", json={"location": "94103"},
+                          headers=self.headers("carol"))
+        self.assertEqual(self.cached(), {"dave"})
+
+    def test_radius(self):
+        """Changing radius drops the user's deck and those reaching them."""
+
+        self.client.patch("/api/users/dave", json={"friend_radius": 200},
+                          headers=self.headers("dave"))
+        self.assertEqual(self.cached(), {"alice", "bob", "carol", "erin"})
+
+    def test_delete(self):
+        """Deleting a user drops their deck and those reaching them."""
+
+        self.client.delete("/api/users/bob", headers=self.headers("bob"))
+        self.assertEqual(self.cached(), {"dave", "erin"})
+
+    def test_swipes(self):
+        """Swiping drops both users' decks, and no others."""
+
+        self.client.post("/api/users/alice/match", json={"match": "bob"},
+                         headers=self.headers("alice"))
+        self.assertEqual(self.cached(), {"carol", "dave", "erin"})
+
+        self.client.post("/api/users/carol/swipes", headers=self.headers("carol"), json={
+            "decisions": [{"username": "dave", "action": "match"},
+                          {"username": "erin", "action": "unmatch"}]})
+        self.assertEqual(self.cached(), set())
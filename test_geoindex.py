@@ -0,0 +1,69 @@
+"""Spatial index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_geoindex.py
+
+
+from unittest import TestCase
+
+import numpy as np
+
+from geoindex import SpatialIndex
+from zipcode import haversine, KM_TO_MI
+
+
+class SpatialIndexTestCase(TestCase):
+    """Radius queries must agree with a brute-force scan."""
+
+    def setUp(self):
+        """Scatter users over the US, Alaska and across the antimeridian."""
+
+        rng = np.random.default_rng(42)
+
+        self.lats = np.concatenate([
+            rng.uniform(25, 49, 3000),
+            rng.uniform(51, 71, 300),
+            rng.uniform(-5, 5, 200),
+        ])
+        self.lons = np.concatenate([
+            rng.uniform(-125, -67, 3000),
+            rng.uniform(-180, -130, 300),
+            rng.uniform(175, 185, 200) - 360 * (rng.random(200) < 0.5),
+        ])
+        self.lons = (self.lons + 180) % 360 - 180
+        self.usernames = [f"user{i}" for i in range(len(self.lats))]
+
+        self.index = SpatialIndex()
+        self.index.rebuild(self.usernames, self.lats, self.lons)
+
+    def brute_force(self, lat, lon, max_distance):
+        distances = haversine(lat, lon, self.lats, self.lons) * KM_TO_MI
+        return {self.usernames[i] for i in np.flatnonzero(distances <= max_distance)}
+
+    def test_matches_brute_force(self):
+        """Index and full scan return the same users for many queries."""
+
+        rng = np.random.default_rng(7)
+
+        for i in rng.choice(len(self.lats), 100, replace=False):
+            for radius in (5, 50, 300, 2000):
+                found = self.index.query_radius(self.lats[i], self.lons[i], radius)
+                self.assertEqual(
+                    set(found), self.brute_force(self.lats[i], self.lons[i], radius))
+
+    def test_add_move_remove(self):
+        """Updates are reflected in later queries."""
+
+        self.index.add("mover", 40.75, -73.99)
+        self.assertIn("mover", self.index.query_radius(40.75, -73.99, 1))
+
+        self.index.add("mover", 37.77, -122.41)
+        self.assertNotIn("mover", self.index.query_radius(40.75, -73.99, 1))
+        self.assertIn("mover", self.index.query_radius(37.77, -122.41, 1))
+
+        self.index.remove("mover")
+        self.assertNotIn("mover", self.index.query_radius(37.77, -122.41, 1))
+
+        self.index.add("unknown", float("nan"), float("nan"))
+        self.assertEqual(len(self.index), len(self.usernames))
@@ -0,0 +1,68 @@
+"""Interest similarity tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_interests.py
+
+
+from unittest import TestCase
+
+import numpy as np
+
+from interests import InterestIndex, tokenize
+
+
+class InterestIndexTestCase(TestCase):
+    """Test tokenizing and TF-IDF ranking."""
+
+    def setUp(self):
+        self.index = InterestIndex()
+        self.index.rebuild([
+            ("climber", "rock climbing, hiking", "Climbing and coffee"),
+            ("hiker", "Hiking", None),
+            ("gamer", "video games", "board games"),
+            ("blank", None, None),
+        ])
+
+    def test_tokenize(self):
+        """Lowercase words, no stopwords or punctuation."""
+
+        self.assertEqual(tokenize("I love Rock-Climbing!", None, "and a dog"),
+                         {"rock", "climbing", "dog"})
+
+    def test_ranking(self):
+        """Closer interests score higher; no overlap scores zero."""
+
+        candidates = ["gamer", "hiker", "climber", "blank", "unindexed"]
+        scores = self.index.scores(tokenize("climbing hiking"), candidates)
+
+        self.assertEqual([candidates[i] for i in np.argsort(-scores)[:2]],
+                         ["climber", "hiker"])
+        self.assertEqual(list(scores[[0, 3, 4]]), [0, 0, 0])
+
+    def test_update(self):
+        """Re-indexing a user replaces their terms."""
+
+        self.index.add("gamer", "climbing", None)
+        scores = self.index.scores({"games"}, ["gamer"])
+
+        self.assertEqual(scores[0], 0)
+        self.assertEqual(len(self.index), 4)
+
+    def test_edits_during_rebuild(self):
+        """The old index serves scores while a rebuild reads its rows, and
+        edits made meanwhile end up in the new index."""
+
+        def rows():
+            yield ("climber", "rock climbing", None)
+            self.assertGreater(self.index.scores({"games"}, ["gamer"])[0], 0)
+            self.index.add("hiker", "video games", None)
+            self.index.remove("climber")
+            yield ("gamer", "video games", None)
+
+        self.index.rebuild(rows())
+
+        self.assertEqual(sorted(self.index.user_terms), ["gamer", "hiker"])
+        self.assertGreater(self.index.scores({"games"}, ["hiker"])[0], 0)
+        self.assertTrue(self.index.start_rebuild())
+        self.assertFalse(self.index.start_rebuild())
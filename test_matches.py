@@ -0,0 +1,59 @@
+"""Match model tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_matches.py
+
+
+from models import db, Match, User
+from testing import DatabaseTestCase
+
+
+class MatchTestCase(DatabaseTestCase):
+    """Test recording swipes and finding mutual matches."""
+
+    def setUp(self):
+        """Create four users."""
+
+        super().setUp()
+
+        for username in ("alice", "bob", "carol", "dave"):
+            db.session.add(User(username=username, email=f"{username}@test.com",
+                                password="HASHED_PASSWORD", location="10001"))
+        db.session.commit()
+
+    def swipe(self, username, **decisions):
+        Match.record_swipes(username, decisions)
+        db.session.commit()
+
+    def unfriended(self, username, match_username):
+        return Match.query.get((username, match_username)).unfriended
+
+    def test_record_swipes(self):
+        """Repeating a swipe keeps one row; the latest decision wins."""
+
+        self.swipe("alice", bob=False, carol=True)
+        self.swipe("alice", bob=False)
+        self.assertEqual(Match.query.count(), 2)
+
+        self.swipe("alice", bob=True)
+        self.assertTrue(self.unfriended("alice", "bob"))
+        self.swipe("alice", bob=False, carol=False)
+        self.assertFalse(self.unfriended("alice", "bob"))
+        self.assertFalse(self.unfriended("alice", "carol"))
+        self.assertEqual(Match.query.count(), 2)
+
+    def test_mutual_matches(self):
+        """Only pairs matched both ways, with neither side unmatched."""
+
+        self.swipe("alice", bob=False, carol=False, dave=False)
+        self.swipe("bob", alice=False)
+        self.swipe("carol", alice=True)
+        self.swipe("dave", alice=False)
+
+        self.assertEqual(sorted(Match.mutual_matches("alice")), ["bob", "dave"])
+        self.assertEqual(Match.mutual_matches("alice", ["dave", "carol"]), ["dave"])
+        self.assertEqual(Match.mutual_matches("carol"), [])
+
+        self.swipe("dave", alice=True)
+        self.assertEqual(Match.mutual_matches("alice"), ["bob"])
@@ -0,0 +1,156 @@
+"""Message and conversation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_messages.py
+
+
+from datetime import datetime
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from models import db, Conversation, Message, User
+from pagination import MAX_PAGE_SIZE
+from testing import DatabaseTestCase, make_api_app
+
+app = make_api_app()
+
+
+class ConversationTestCase(DatabaseTestCase):
+    """Two users who can message each other."""
+
+    def setUp(self):
+        """Create two users."""
+
+        super().setUp()
+
+        for username in ("alice", "bob"):
+            db.session.add(User(username=username, email=f"{username}@test.com",
+                                password="HASHED_PASSWORD", location="10001"))
+        db.session.commit()
+
+    def send(self, user_from, user_to, count):
+        """Send `count` messages; returns their ids."""
+
+        ids = [Message.add_message(user_from, user_to, f"message {i}").id
+               for i in range(count)]
+        db.session.commit()
+
+        return ids
+
+
+class MessageTestCase(ConversationTestCase):
+    """Test reading conversations."""
+
+    def test_since(self):
+        """since() returns newer messages, whether or not `since_id` is
+        one of the conversation's messages."""
+
+        ids = self.send("alice", "bob", 3) + self.send("bob", "alice", 3)
+        ids += self.send("alice", "bob", 1)
+
+        def since(since_id):
+            return [message.id for message in Message.since("alice", "bob", since_id, 100)]
+
+        self.assertEqual(since(0), ids)
+        self.assertEqual(since(ids[3]), ids[4:])
+        self.assertEqual(since(ids[-1]), [])
+        self.assertEqual(since(ids[-1] + 100), [])
+
+    def test_paging_equal_times(self):
+        """Paging both ways through a two-sided thread whose messages all
+        have the same sent_at visits every message once, in id order."""
+
+        ids = []
+        for _ in range(4):
+            ids += self.send("alice", "bob", 2) + self.send("bob", "alice", 1)
+        Message.query.update({Message.sent_at: datetime(2022, 1, 1)})
+        db.session.commit()
+
+        def page(**cursor):
+            return [message.id for message in Message.conversation("alice", "bob", 5, **cursor)]
+
+        newest = page()
+        older = page(before=newest[0])
+        self.assertEqual(newest, ids[-5:])
+        self.assertEqual(older, ids[2:7])
+        self.assertEqual(page(before=older[0]), ids[:2])
+
+        first = page(after=ids[0])
+        self.assertEqual(first, ids[1:6])
+        self.assertEqual(page(after=first[-1]), ids[6:11])
+        self.assertEqual(page(after=ids[-1]), [])
+
+        with self.assertRaises(ValueError):
+            page(before=ids[5], after=ids[2])
+
+    def test_cursor_uses_index(self):
+        """A before= page is an index range scan bounded by the cursor,
+        already in order."""
+
+        ids = self.send("alice", "bob", 3)
+        statements = []
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if "ORDER BY messages.sent_at" in statement:
+                statements.append((statement, parameters))
+
+        try:
+            Message.conversation("alice", "bob", 5, before=ids[-1])
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        statement, parameters = statements[0]
+        plan = " ".join(row[-1] for row in db.session.connection().exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + statement, parameters))
+        self.assertIn("ix_messages_conversation_id (user_from=? AND user_to=? AND sent_at<?)",
+                      plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_unread_counts(self):
+        """The recipient's unread count grows with each message; replying
+        clears the replier's count."""
+
+        def unread(username, partner):
+            return Conversation.query.get((username, partner)).unread_count
+
+        self.send("alice", "bob", 3)
+        self.assertEqual(unread("bob", "alice"), 3)
+        self.assertEqual(unread("alice", "bob"), 0)
+
+        last = self.send("bob", "alice", 1)[0]
+        self.assertEqual(unread("bob", "alice"), 0)
+        self.assertEqual(unread("alice", "bob"), 1)
+        self.assertEqual(Conversation.query.get(("alice", "bob")).last_message_id, last)
+
+
+class SendMessageTestCase(ConversationTestCase):
+    """Test the send message route."""
+
+    app = app
+
+    def test_since_has_more(self):
+        """With more new messages than fit in a page, the response says so
+        and the rest can be paged with after=."""
+
+        ids = self.send("bob", "alice", MAX_PAGE_SIZE + 50)
+        client = app.test_client()
+        headers = {"Authorization": "Bearer " + create_access_token(identity="alice")}
+
+        response = client.post("/api/users/alice/bob", json={"text": "hi", "since_id": 0},
+                               headers=headers)
+        messages = [message["id"] for message in response.json["messages"]]
+        self.assertEqual(messages, ids[:MAX_PAGE_SIZE])
+        self.assertTrue(response.json["has_more"])
+
+        response = client.get(f"/api/users/alice/bob?limit=100&after={messages[-1]}",
+                              headers=headers)
+        rest = [message["id"] for message in response.json["messages"]]
+        self.assertEqual(rest[:-1], ids[MAX_PAGE_SIZE:])
+
+        response = client.post("/api/users/alice/bob", json={"text": "hi", "since_id": rest[-1]},
+                               headers=headers)
+        self.assertEqual(len(response.json["messages"]), 1)
+        self.assertFalse(response.json["has_more"])
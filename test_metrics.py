@@ -0,0 +1,114 @@
+"""Metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+from unittest import TestCase
+
+import metrics
+from metrics import Counter, Histogram, Registry
+from models import User
+from testing import DatabaseTestCase, make_app
+
+app = make_app(SLOW_REQUEST_MS=0)
+metrics.init_app(app)
+
+
+@app.get("/test/users/<int:count>")
+def list_users(count):
+    for _ in range(count):
+        User.query.get("nobody")
+    return "ok"
+
+
+@app.get("/test/fail")
+def fail():
+    raise RuntimeError("boom")
+
+
+class FormatTestCase(TestCase):
+    """Test the text format."""
+
+    def test_histogram(self):
+        """Buckets are cumulative and end in +Inf, with sum and count."""
+
+        registry = Registry()
+        histogram = registry.register(
+            Histogram("latency_seconds", "Latency.", ["route"], buckets=(0.1, 1)))
+        histogram.observe(0.05, route="/a")
+        histogram.observe(0.5, route="/a")
+        histogram.observe(5, route="/a")
+
+        self.assertEqual(registry.render().splitlines(), [
+            "# HELP latency_seconds Latency.",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{route="/a",le="0.1"} 1',
+            'latency_seconds_bucket{route="/a",le="1.0"} 2',
+            'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+            'latency_seconds_sum{route="/a"} 5.55',
+            'latency_seconds_count{route="/a"} 3',
+        ])
+
+    def test_counter_labels(self):
+        """Label values are escaped and label names are checked."""
+
+        counter = Counter("hits_total", "Hits.", ["path"])
+        counter.inc(path='say "hi"\n')
+        counter.inc(2, path='say "hi"\n')
+
+        self.assertEqual(counter.render()[-1], 'hits_total{path="say \\"hi\\"\\n"} 3')
+        with self.assertRaises(ValueError):
+            counter.inc(route="/a")
+
+
+class RequestMetricsTestCase(DatabaseTestCase):
+    """Test request timing and SQL counting."""
+
+    app = app
+
+    def setUp(self):
+        super().setUp()
+        self.client = app.test_client()
+
+        for metric in metrics.registry.metrics:
+            metric.clear()
+
+    def test_statements_per_request(self):
+        """Each request's statements are counted under its route."""
+
+        route = "/test/users/<int:count>"
+
+        with self.assertLogs("metrics", "WARNING") as logs:
+            self.client.get("/test/users/3")
+            self.client.get("/test/users/5")
+
+        self.assertEqual(metrics.request_statements.count(route=route), 2)
+        self.assertEqual(metrics.request_statements.sum(route=route), 8)
+        self.assertEqual(
+            metrics.request_seconds.count(method="GET", route=route, status="200"), 2)
+        self.assertEqual(metrics.slow_requests.value(route=route), 2)
+        self.assertIn("FROM users", logs.output[0])
+
+    def test_failed_request(self):
+        """Requests that raise are recorded as 500s."""
+
+        app.testing = False
+        try:
+            self.client.get("/test/fail")
+        finally:
+            app.testing = True
+
+        self.assertEqual(
+            metrics.request_seconds.count(method="GET", route="/test/fail", status="500"), 1)
+
+    def test_metrics_endpoint(self):
+        """/metrics serves every metric in the text format."""
+
+        self.client.get("/test/users/1")
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.content_type, metrics.CONTENT_TYPE)
+        self.assertIn('friender_request_sql_statements_count{route="/test/users/<int:count>"}',
+                      response.get_data(as_text=True))
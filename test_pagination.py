@@ -0,0 +1,43 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+from unittest import TestCase
+
+import numpy as np
+
+from pagination import decode_cursor, encode_cursor, nearest_page
+
+
+class NearestPageTestCase(TestCase):
+    """Paging with nearest_page must walk the full sort order."""
+
+    def test_pages_match_full_sort(self):
+        """Pages, with lots of distance ties, concatenate to the sorted list."""
+
+        rng = np.random.default_rng(3)
+        distances = np.round(rng.uniform(0, 5, 500), 0)
+        names = np.array([f"user{i}" for i in rng.permutation(500)], dtype=object)
+
+        expected = sorted(zip(distances, names))
+
+        seen = []
+        after = None
+        while True:
+            page = nearest_page(distances, names, 7, after)
+            seen.extend((distances[i], names[i]) for i in page)
+            if len(page) < 7:
+                break
+            cursor = encode_cursor(float(distances[page[-1]]), names[page[-1]])
+            after = decode_cursor(cursor)
+
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor(self):
+        """Garbage cursors raise ValueError."""
+
+        with self.assertRaises(ValueError):
+            decode_cursor("not a cursor")
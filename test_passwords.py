@@ -0,0 +1,37 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+from unittest import TestCase
+
+from passwords import PasswordHasher, get_rounds
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test hashing on the pool and rehash detection."""
+
+    def test_pool_hash_and_check(self):
+        """Hashes made on the process pool verify."""
+
+        hasher = PasswordHasher(rounds=4, workers=2)
+        hashed = hasher.hash("HASHED_PASSWORD")
+
+        self.assertTrue(hasher.check(hashed, "HASHED_PASSWORD"))
+        self.assertFalse(hasher.check(hashed, "wrong"))
+        hasher.shutdown()
+
+    def test_needs_rehash(self):
+        """A change of cost factor flags old hashes."""
+
+        hasher = PasswordHasher(rounds=4, workers=0)
+        hashed = hasher.hash("HASHED_PASSWORD")
+
+        self.assertEqual(get_rounds(hashed), 4)
+        self.assertFalse(hasher.needs_rehash(hashed))
+
+        hasher.configure(rounds=5, workers=0)
+        self.assertTrue(hasher.needs_rehash(hashed))
+        self.assertTrue(hasher.check(hashed, "HASHED_PASSWORD"))
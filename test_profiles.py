@@ -0,0 +1,100 @@
+"""Current user and profile cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_profiles.py
+
+
+from flask_jwt_extended import create_access_token, verify_jwt_in_request
+from sqlalchemy import event
+
+from app import current_user, load_user
+from models import db, User
+from testing import DatabaseTestCase, make_api_app
+
+app = make_api_app()
+
+
+class UsersTestCase(DatabaseTestCase):
+    """alice and bob, with tokens."""
+
+    app = app
+
+    def setUp(self):
+        super().setUp()
+
+        for username in ("alice", "bob"):
+            db.session.add(User(username=username, email=f"{username}@test.com",
+                                password="HASHED_PASSWORD", location="10001", bio="old"))
+        db.session.commit()
+
+        self.alice = {"Authorization": "Bearer " + create_access_token(identity="alice")}
+        self.bob = {"Authorization": "Bearer " + create_access_token(identity="bob")}
+
+
+class CurrentUserTestCase(UsersTestCase):
+    """Test loading the requesting user."""
+
+    def test_loaded_once(self):
+        """The identity's row is read once however often it's asked for;
+        other users are read as usual."""
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        db.session.expunge_all()
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            with app.test_request_context(headers=self.alice):
+                verify_jwt_in_request()
+
+                user = current_user()
+                # so a second lookup would have to go to the database
+                db.session.expunge_all()
+                self.assertIs(current_user(), user)
+                self.assertIs(load_user("alice"), user)
+                self.assertEqual(len(statements), 1)
+
+                self.assertEqual(load_user("bob").username, "bob")
+                self.assertEqual(len(statements), 2)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+
+class ProfileCacheTestCase(UsersTestCase):
+    """Test that changing a user drops their cached profile."""
+
+    def setUp(self):
+        """Cache alice's profile."""
+
+        super().setUp()
+        self.detach()
+
+        self.client = app.test_client()
+        self.profiles = app.extensions["friender"]["profiles"]
+
+        self.client.get("/api/users/alice", headers=self.bob)
+        self.assertEqual(self.profiles.get("alice")["bio"], "old")
+
+    def tearDown(self):
+        self.profiles.clear()
+        super().tearDown()
+
+    def test_patch(self):
+        """An edit is seen by the next read."""
+
+        self.client.patch("/api/users/alice", json={"bio": "new"}, headers=self.alice)
+
+        self.assertIsNone(self.profiles.get("alice"))
+        response = self.client.get("/api/users/alice", headers=self.bob)
+        self.assertEqual(response.json["user"]["bio"], "new")
+
+    def test_delete(self):
+        """A deleted user isn't served from the cache."""
+
+        self.client.delete("/api/users/alice", headers=self.alice)
+
+        response = self.client.get("/api/users/alice", headers=self.bob)
+        self.assertEqual(response.json, {"msg": "User not found!"})
@@ -0,0 +1,179 @@
+"""Pub/sub broker tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pubsub.py
+
+
+import json
+import threading
+from unittest import TestCase
+
+from flask_jwt_extended import create_access_token
+
+from models import db, Message, User
+from pagination import MAX_PAGE_SIZE
+from pubsub import Broker, RedisBroker, make_broker
+from testing import DatabaseTestCase, make_api_app
+
+app = make_api_app(STREAM_KEEPALIVE=0.05)
+
+
+class BrokerTestCase(TestCase):
+    """Test the in-process broker used locally and in tests."""
+
+    def setUp(self):
+        self.broker = make_broker()
+
+    def test_make_broker(self):
+        """No url gives the in-process broker."""
+
+        self.assertIsInstance(self.broker, Broker)
+
+    def test_publish_subscribe(self):
+        """Subscribers get payloads for their own channel only."""
+
+        alice = self.broker.subscribe("messages:alice")
+        alice2 = self.broker.subscribe("messages:alice")
+        bob = self.broker.subscribe("messages:bob")
+
+        self.broker.publish("messages:alice", "hi")
+
+        self.assertEqual(alice.get(timeout=1), "hi")
+        self.assertEqual(alice2.get(timeout=1), "hi")
+        self.assertIsNone(bob.get(timeout=0.01))
+
+    def test_close(self):
+        """Closed subscriptions stop receiving and are forgotten."""
+
+        alice = self.broker.subscribe("messages:alice")
+        alice.close()
+
+        self.broker.publish("messages:alice", "hi")
+
+        self.assertIsNone(alice.get(timeout=0.01))
+        self.assertEqual(self.broker.subscriptions, {})
+
+    def test_cross_thread(self):
+        """A publish from another thread wakes a waiting subscriber."""
+
+        alice = self.broker.subscribe("messages:alice")
+        timer = threading.Timer(0.05, self.broker.publish, ("messages:alice", "later"))
+        timer.start()
+
+        self.assertEqual(alice.get(timeout=5), "later")
+        timer.join()
+
+
+class FakeRedis():
+    """Redis pub/sub whose first connection fails; later ones get `events`
+    and then stay open until `closed` is set."""
+
+    def __init__(self, events):
+        self.events = events
+        self.connections = 0
+        self.closed = threading.Event()
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        self.connections += 1
+        if self.connections == 1:
+            raise ConnectionError("redis is down")
+        return self
+
+    def psubscribe(self, pattern):
+        self.pattern = pattern
+
+    def listen(self):
+        yield from self.events
+        self.closed.wait()
+
+    def close(self):
+        pass
+
+
+class RedisBrokerTestCase(TestCase):
+    """Test relaying through Redis, with a stand-in client."""
+
+    def test_reconnect(self):
+        """A failed connection is logged and retried."""
+
+        redis = FakeRedis([{"channel": b"friender:messages:alice", "data": b"hi"}])
+        RedisBroker.reconnect_delay = 0.01
+        self.addCleanup(redis.closed.set)
+        self.addCleanup(setattr, RedisBroker, "reconnect_delay", 0.5)
+
+        with self.assertLogs("pubsub", "ERROR") as logs:
+            broker = RedisBroker(None, client=redis)
+            alice = broker.subscribe("messages:alice")
+
+            self.assertEqual(alice.get(timeout=5), "hi")
+
+        self.assertEqual(redis.connections, 2)
+        self.assertEqual(redis.pattern, "friender:*")
+        self.assertIn("redis is down", logs.output[0])
+
+
+class StreamTestCase(DatabaseTestCase):
+    """Test the server-sent events stream of a user's messages."""
+
+    app = app
+
+    def setUp(self):
+        super().setUp()
+
+        for username in ("alice", "bob"):
+            db.session.add(User(username=username, email=f"{username}@test.com",
+                                password="HASHED_PASSWORD", location="10001"))
+        self.ids = [Message.add_message("bob", "alice", f"message {i}").id
+                    for i in range(3)]
+        db.session.commit()
+
+        self.headers = {"Authorization": "Bearer " + create_access_token(identity="alice")}
+
+    def test_stream(self):
+        """Messages after Last-Event-ID are replayed, then published messages
+        follow, with keepalives while nothing arrives."""
+
+        response = app.test_client().get(
+            "/api/users/alice/messages/stream",
+            headers={**self.headers, "Last-Event-ID": str(self.ids[0])},
+            buffered=False)
+        events = iter(response.response)
+
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertTrue(next(events).startswith(b"retry: "))
+        for message_id in self.ids[1:]:
+            self.assertTrue(next(events).startswith(f"id: {message_id}\n".encode()))
+        self.assertEqual(next(events), b": keepalive\n\n")
+
+        broker = app.extensions["friender"]["broker"]
+        broker.publish("messages:alice", json.dumps({"id": 99, "text": "hi"}))
+        self.assertEqual(next(events),
+                         b'id: 99\nevent: message\ndata: {"id": 99, "text": "hi"}\n\n')
+
+        response.close()
+        self.assertEqual(broker.subscriptions, {})
+
+    def test_replay_pages(self):
+        """Replay goes on past the first page until it has caught up, and a
+        replayed message published again isn't repeated."""
+
+        ids = self.ids + [Message.add_message("bob", "alice", f"later {i}").id
+                          for i in range(MAX_PAGE_SIZE)]
+        db.session.commit()
+
+        response = app.test_client().get(
+            "/api/users/alice/messages/stream",
+            headers={**self.headers, "Last-Event-ID": "0"},
+            buffered=False)
+        events = iter(response.response)
+        next(events)
+
+        replayed = [int(next(events).split(b"\n")[0][len(b"id: "):]) for _ in ids]
+        self.assertEqual(replayed, ids)
+
+        broker = app.extensions["friender"]["broker"]
+        broker.publish("messages:alice", json.dumps({"id": ids[-1]}))
+        self.assertEqual(next(events), b": keepalive\n\n")
+
+        response.close()
@@ -0,0 +1,207 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+
+
+import os
+import tempfile
+
+from flask import jsonify
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity, jwt_required
+
+import replicas
+from app import create_app
+from models import db, User
+from replicas import LocalWrites, RedisWrites, use_replica
+from testing import DatabaseTestCase, make_app
+
+tmpdir = tempfile.TemporaryDirectory()
+
+
+class FakeRedis():
+    """The two Redis commands RedisWrites uses, on a dict."""
+
+    def __init__(self):
+        self.keys = {}
+
+    def set(self, key, value, ex=None):
+        self.keys[key] = value
+
+    def exists(self, key):
+        return int(key in self.keys)
+
+
+class BrokenRedis():
+    """A Redis that can't be reached."""
+
+    def set(self, key, value, ex=None):
+        raise ConnectionError("redis is down")
+
+    exists = set
+
+
+app = make_app(
+    SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(tmpdir.name, "primary.db"),
+    SQLALCHEMY_BINDS={"replica": "sqlite:///" + os.path.join(tmpdir.name, "replica.db")},
+    SECRET_KEY="itsasecret",
+)
+JWTManager(app)
+replicas.init_app(app)
+
+api_app = create_app(dict(
+    SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(tmpdir.name, "api-primary.db"),
+    SQLALCHEMY_BINDS={"replica": "sqlite:///" + os.path.join(tmpdir.name, "api-replica.db")},
+    SECRET_KEY="itsasecret",
+    S3_BUCKET="friender-test",
+    PASSWORD_HASH_WORKERS=0,
+))
+
+
+@app.get("/test/users")
+@jwt_required()
+@use_replica
+def list_users():
+    return jsonify(users=[user.username for user in User.query.order_by(User.username)])
+
+
+@app.post("/test/users")
+@jwt_required()
+def add_user():
+    db.session.add(User(username=get_jwt_identity() + "-new", email="new@test.com",
+                        password="HASHED_PASSWORD", location="10001"))
+    db.session.commit()
+    return jsonify(msg="added")
+
+
+class ReplicaTestCase(DatabaseTestCase):
+    """Test which database reads and writes go to."""
+
+    app = app
+
+    def setUp(self):
+        """Put a different user in the primary and the replica."""
+
+        super().setUp()
+        self.replica = db.get_engine(app, bind="replica")
+        db.metadata.create_all(self.replica)
+
+        db.session.add(User(username="primary", email="primary@test.com",
+                            password="HASHED_PASSWORD", location="10001"))
+        db.session.commit()
+        with self.replica.begin() as connection:
+            connection.execute(User.__table__.insert(), dict(
+                username="replica", email="replica@test.com",
+                password="HASHED_PASSWORD", location="10001", friend_radius=50))
+
+        self.client = app.test_client()
+        self.headers = {"Authorization": "Bearer " + create_access_token(identity="alice")}
+
+    def tearDown(self):
+        db.metadata.drop_all(self.replica)
+        app.extensions["replicas"] = LocalWrites(10)
+        super().tearDown()
+
+    def test_reads_use_replica(self):
+        """Decorated views read from the replica."""
+
+        response = self.client.get("/test/users", headers=self.headers)
+        self.assertEqual(response.json["users"], ["replica"])
+
+    def test_read_your_writes(self):
+        """After a user writes, their reads go to the primary; other
+        users still read from the replica."""
+
+        self.client.post("/test/users", headers=self.headers)
+
+        response = self.client.get("/test/users", headers=self.headers)
+        self.assertEqual(response.json["users"], ["alice-new", "primary"])
+
+        other = {"Authorization": "Bearer " + create_access_token(identity="bob")}
+        response = self.client.get("/test/users", headers=other)
+        self.assertEqual(response.json["users"], ["replica"])
+
+    def test_writes_use_primary(self):
+        """Writes go to the primary."""
+
+        self.client.post("/test/users", headers=self.headers)
+
+        self.assertEqual(User.query.get("alice-new").email, "new@test.com")
+        with self.replica.connect() as connection:
+            rows = connection.execute(User.__table__.select()).fetchall()
+        self.assertEqual([row.username for row in rows], ["replica"])
+
+    def test_writes_shared_between_workers(self):
+        """With Redis, a write seen by one worker keeps the user's reads on
+        the primary in every worker; if Redis is down, reads use the primary."""
+
+        redis = FakeRedis()
+        app.extensions["replicas"] = RedisWrites(redis, 10)
+        self.client.post("/test/users", headers=self.headers)
+
+        # another worker, sharing the same Redis
+        app.extensions["replicas"] = RedisWrites(redis, 10)
+        response = self.client.get("/test/users", headers=self.headers)
+        self.assertEqual(response.json["users"], ["alice-new", "primary"])
+
+        app.extensions["replicas"] = RedisWrites(BrokenRedis(), 10)
+        with self.assertLogs("replicas", "ERROR"):
+            response = self.client.get("/test/users", headers=self.headers)
+        self.assertEqual(response.json["users"], ["alice-new", "primary"])
+
+
+class CachedRouteTestCase(DatabaseTestCase):
+    """Test that the profile cache keeps read-your-writes."""
+
+    app = api_app
+
+    def setUp(self):
+        """Put alice, with an old bio, in the primary and the replica."""
+
+        super().setUp()
+        self.replica = db.get_engine(api_app, bind="replica")
+        db.metadata.create_all(self.replica)
+
+        alice = dict(username="alice", email="alice@test.com", bio="old",
+                     password="HASHED_PASSWORD", location="10001", friend_radius=50)
+        db.session.add(User(**alice))
+        db.session.commit()
+        with self.replica.begin() as connection:
+            connection.execute(User.__table__.insert(), alice)
+
+        self.client = api_app.test_client()
+        self.alice = {"Authorization": "Bearer " + create_access_token(identity="alice")}
+        self.bob = {"Authorization": "Bearer " + create_access_token(identity="bob")}
+
+        # give each request its own app context, and so its own session
+        self.ctx.pop()
+
+    def tearDown(self):
+        self.ctx.push()
+        db.metadata.drop_all(self.replica)
+        api_app.extensions["replicas"].clear()
+        api_app.extensions["friender"]["profiles"].clear()
+        super().tearDown()
+
+    def test_replica_reads_not_cached(self):
+        """Another user's replica read doesn't cache the lagging profile
+        that the writer would then be served."""
+
+        self.client.patch("/api/users/alice", json={"bio": "new"}, headers=self.alice)
+
+        response = self.client.get("/api/users/alice", headers=self.bob)
+        self.assertEqual(response.json["user"]["bio"], "old")
+
+        response = self.client.get("/api/users/alice", headers=self.alice)
+        self.assertEqual(response.json["user"]["bio"], "new")
+
+    def test_recent_writer_skips_cache(self):
+        """A user who just wrote isn't served a profile another worker
+        cached before the write."""
+
+        self.client.patch("/api/users/alice", json={"bio": "new"}, headers=self.alice)
+        api_app.extensions["friender"]["profiles"].set("alice", {"bio": "old"})
+
+        response = self.client.get("/api/users/alice", headers=self.alice)
+        self.assertEqual(response.json["user"]["bio"], "new")
@@ -0,0 +1,54 @@
+"""User search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+from models import db, User
+from search import search_users
+from testing import DatabaseTestCase
+
+
+class SearchTestCase(DatabaseTestCase):
+    """Test search against the SQLite FTS5 stand-in."""
+
+    def setUp(self):
+        """Create users with a few bios."""
+
+        super().setUp()
+
+        for username, bio, hobbies, interests in [
+            ("climber", "Weekend climber", "rock climbing", "coffee"),
+            ("hiker", "Out on trails", "hiking, climbing", None),
+            ("gamer", "Board games", None, "video games"),
+        ]:
+            db.session.add(User(username=username, email=f"{username}@test.com",
+                                password="HASHED_PASSWORD", location="10001",
+                                bio=bio, hobbies=hobbies, interests=interests))
+        db.session.commit()
+
+    def test_search(self):
+        """Matches come back ranked, all words must match."""
+
+        found = [username for username, _ in search_users("climbing", 10)]
+        self.assertEqual(sorted(found), ["climber", "hiker"])
+
+        found = [username for username, _ in search_users("climbing coffee", 10)]
+        self.assertEqual(found, ["climber"])
+
+        self.assertEqual(search_users("'\"*", 10), [])
+
+    def test_updates_and_paging(self):
+        """Edits are searchable, and results page and restrict."""
+
+        gamer = User.query.get("gamer")
+        gamer.hobbies = "climbing"
+        db.session.commit()
+
+        everyone = search_users("climbing", 10)
+        self.assertEqual(len(everyone), 3)
+        self.assertEqual(search_users("climbing", 2, offset=1), everyone[1:3])
+
+        found = search_users("climbing", 10, usernames=["gamer", "hiker"])
+        self.assertEqual(sorted(username for username, _ in found), ["gamer", "hiker"])
@@ -0,0 +1,190 @@
+"""Photo storage tests, against moto's local S3 stand-in."""
+
+# run these tests like:
+#
+#    python -m unittest test_storage.py
+
+
+from datetime import timedelta
+from unittest import TestCase, skipUnless
+
+from flask_jwt_extended import create_access_token
+
+try:
+    import requests
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+from models import db, Images, StorageDeletion, User
+from storage import (drain_deletions, get_object_info, is_photo_key,
+                     make_s3_client, new_photo_key, presign_upload,
+                     reconcile_storage)
+from testing import DatabaseTestCase, make_api_app
+
+BUCKET = "friender-test"
+
+app = make_api_app(S3_KEY="test", S3_SECRET="test", S3_REGION="us-east-1",
+                   MAX_PHOTO_BYTES=2)
+
+
+@skipUnless(mock_aws, "needs moto and requests")
+class PresignedUploadTestCase(TestCase):
+    """Test the presigned upload round trip."""
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+
+        self.s3 = make_s3_client({"S3_KEY": "test", "S3_SECRET": "test",
+                                  "S3_REGION": "us-east-1"})
+        self.s3.create_bucket(Bucket=BUCKET)
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_upload(self):
+        """A client PUT to the presigned URL lands the object."""
+
+        key = new_photo_key("testuser")
+        url = presign_upload(self.s3, BUCKET, key, 60)
+
+        response = requests.put(url, data=b"\xff\xd8\xff",
+                                headers={"Content-Type": "image/jpeg"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_object_info(self.s3, BUCKET, key)["ContentLength"], 3)
+
+    def test_missing_object(self):
+        """No upload, no object."""
+
+        self.assertIsNone(get_object_info(self.s3, BUCKET, new_photo_key("testuser")))
+
+    def test_keys(self):
+        """Keys belong to the user they were made for."""
+
+        key = new_photo_key("testuser")
+
+        self.assertTrue(is_photo_key("testuser", key))
+        self.assertFalse(is_photo_key("testuser2", key))
+        self.assertFalse(is_photo_key("testuser", "testuser/../other"))
+        self.assertFalse(is_photo_key("testuser", 5))
+        self.assertFalse(is_photo_key("testuser", None))
+
+
+@skipUnless(mock_aws, "needs moto and requests")
+class DeletionQueueTestCase(DatabaseTestCase):
+    """Test draining the deletion queue and finding orphans."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.mock = mock_aws()
+        self.mock.start()
+        self.s3 = make_s3_client({"S3_KEY": "test", "S3_SECRET": "test",
+                                  "S3_REGION": "us-east-1"})
+        self.s3.create_bucket(Bucket=BUCKET)
+
+        db.session.add(User(username="testuser", email="test@test.com",
+                            password="HASHED_PASSWORD", location="10001"))
+        for key in ("testuser/kept", "testuser/orphan", "testuser/queued"):
+            self.s3.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+        db.session.add(Images(username="testuser", path="kept", filename="testuser/kept"))
+        db.session.commit()
+
+    def tearDown(self):
+        self.mock.stop()
+        super().tearDown()
+
+    def keys(self):
+        return {obj["Key"] for obj in
+                self.s3.list_objects_v2(Bucket=BUCKET).get("Contents", ())}
+
+    def test_drain(self):
+        """Queued keys are deleted from S3 and dequeued."""
+
+        StorageDeletion.enqueue(["testuser/queued", "testuser/missing"])
+        db.session.commit()
+
+        self.assertEqual(drain_deletions(self.s3, BUCKET, batch_size=1), 2)
+        self.assertEqual(self.keys(), {"testuser/kept", "testuser/orphan"})
+        self.assertEqual(StorageDeletion.query.count(), 0)
+
+    def test_reconcile(self):
+        """Objects without an image row get queued, once."""
+
+        StorageDeletion.enqueue(["testuser/queued"])
+        db.session.commit()
+
+        self.assertEqual(reconcile_storage(self.s3, BUCKET, timedelta(0)), 1)
+        self.assertEqual(reconcile_storage(self.s3, BUCKET, timedelta(0)), 0)
+        self.assertEqual({row.key for row in StorageDeletion.query},
+                         {"testuser/queued", "testuser/orphan"})
+
+
+@skipUnless(mock_aws, "needs moto and requests")
+class CompleteUploadTestCase(DatabaseTestCase):
+    """Test completing a presigned upload."""
+
+    app = app
+
+    def setUp(self):
+        super().setUp()
+
+        self.mock = mock_aws()
+        self.mock.start()
+        self.s3 = make_s3_client(app.config)
+        self.s3.create_bucket(Bucket=BUCKET)
+
+        db.session.add(User(username="testuser", email="test@test.com",
+                            password="HASHED_PASSWORD", location="10001"))
+        db.session.commit()
+
+        self.client = app.test_client()
+        self.headers = {"Authorization": "Bearer " + create_access_token(identity="testuser")}
+
+    def tearDown(self):
+        app.extensions["friender"].pop("s3", None)
+        self.mock.stop()
+        super().tearDown()
+
+    def test_too_large(self):
+        """An oversized upload is queued for deletion, not deleted in the
+        request, and gets no image row."""
+
+        key = new_photo_key("testuser")
+        self.s3.put_object(Bucket=BUCKET, Key=key, Body=b"xxx")
+
+        response = self.client.post("/api/users/testuser/photos/uploads/complete",
+                                    json={"key": key}, headers=self.headers)
+
+        self.assertEqual(response.json["msg"], "Image too large!")
+        self.assertEqual([row.key for row in StorageDeletion.query], [key])
+        self.assertIsNotNone(get_object_info(self.s3, BUCKET, key))
+        self.assertEqual(Images.query.count(), 0)
+
+    def test_photo_changes_drop_profile(self):
+        """Completing an upload and deleting a photo drop the user's cached
+        profile."""
+
+        profiles = app.extensions["friender"]["profiles"]
+        self.addCleanup(profiles.clear)
+
+        key = new_photo_key("testuser")
+        self.s3.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+
+        profiles.set("testuser", {"username": "testuser"})
+        response = self.client.post("/api/users/testuser/photos/uploads/complete",
+                                    json={"key": key}, headers=self.headers)
+        # let the variant render finish before the tables go
+        app.extensions["friender"]["variant_pipeline"].shutdown()
+
+        self.assertEqual(response.json["msg"], "success")
+        self.assertIsNone(profiles.get("testuser"))
+
+        profiles.set("testuser", {"username": "testuser"})
+        self.client.delete(f"/api/users/testuser/photos/{response.json['image']['id']}",
+                           headers=self.headers)
+
+        self.assertIsNone(profiles.get("testuser"))
+        self.assertEqual(Images.query.count(), 0)
@@ -7,27 +7,34 @@
 
 import os
 # from typing_extensions import TypeVarTuple
-from unittest import TestCase
 from sqlalchemy.exc import IntegrityError
-from models import db, User, Message, Images, Match
+from models import db, User
+from testing import DatabaseTestCase, use_test_zipcodes
 
-os.environ['DATABASE_URL'] = "postgresql:///friender_test"
-os.environ['SECRET_KEY'] = "itsasecret"
-from app import app
+from app import create_app
 
-db.create_all()
+# set TEST_DATABASE_URL to run against e.g. postgresql:///friender_test
+app = create_app(dict(
+    SQLALCHEMY_DATABASE_URI=os.environ.get('TEST_DATABASE_URL', "sqlite://"),
+    SECRET_KEY="itsasecret",
+    S3_KEY="test",
+    S3_SECRET="test",
+    S3_BUCKET="friender-test",
+    BCRYPT_LOG_ROUNDS=4,
+    PASSWORD_HASH_WORKERS=0,
+))
 
 
-class UserModelTestCase(TestCase):
+class UserModelTestCase(DatabaseTestCase):
     """Test views for messages."""
 
+    app = app
+
     def setUp(self):
         """Create test client, add sample data."""
 
-        User.query.delete()
-        Message.query.delete()
-        Images.query.delete()
-        Match.query.delete()
+        super().setUp()
+        use_test_zipcodes(self)
 
         self.client = app.test_client()
 
@@ -35,25 +42,26 @@ class UserModelTestCase(TestCase):
             email="test@test.com",
             username="testuser",
             password="HASHED_PASSWORD",
-            zipcode=12345
+            location="12345"
         )
 
         u2 = User.signup(
             email="test2@test.com",
             username="testuser2",
             password="HASHED_PASSWORD2",
-            zipcode=54321
+            location="54321"
         )
 
         db.session.add_all([u,u2])
         db.session.commit()
 
-        self.u_id = u.id
-        self.u2_id = u2.id
+        self.u_id = u.username
+        self.u2_id = u2.username
 
     def tearDown(self):
         """Remove all session commits."""
         db.session.rollback()
+        super().tearDown()
 
     def test_user_model(self):
         """Does basic model work?"""
@@ -0,0 +1,46 @@
+"""Image variant rendering tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_variants.py
+
+
+import io
+from unittest import TestCase
+
+from PIL import Image
+
+from variants import render_variants, VARIANT_SIZES
+
+
+def make_jpeg(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 80, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class RenderVariantsTestCase(TestCase):
+    """Test resizing."""
+
+    def test_sizes(self):
+        """Every variant fits its box and keeps the aspect ratio."""
+
+        rendered = render_variants(make_jpeg(3000, 2000))
+
+        self.assertEqual({name for name, *_ in rendered}, set(VARIANT_SIZES))
+
+        for name, format, width, height, body in rendered:
+            self.assertEqual(format, "jpeg")
+            self.assertEqual(width, VARIANT_SIZES[name])
+            self.assertAlmostEqual(width / height, 1.5, places=1)
+            with Image.open(io.BytesIO(body)) as image:
+                self.assertEqual(image.size, (width, height))
+
+    def test_no_upscale_and_webp(self):
+        """Small images stay small; WebP doubles the renditions."""
+
+        rendered = render_variants(make_jpeg(100, 50), webp=True)
+
+        self.assertEqual(len(rendered), 2 * len(VARIANT_SIZES))
+        self.assertTrue(all(width == 100 for _, _, width, _, _ in rendered))
+        self.assertEqual({format for _, format, *_ in rendered}, {"jpeg", "webp"})
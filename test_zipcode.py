@@ -0,0 +1,50 @@
+"""Zipcode table and distance tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_zipcode.py
+
+
+from unittest import TestCase
+
+import zipcode
+from testing import use_test_zipcodes
+from zipcode import Distance
+
+
+class ZipcodeTestCase(TestCase):
+    """Test the memory-mapped zipcode table."""
+
+    def setUp(self):
+        """Build a small table and point Distance at it."""
+
+        self.count = use_test_zipcodes(self)
+
+    def test_lookup(self):
+        """Known zipcodes resolve in order, unknown ones are NaN."""
+
+        self.assertEqual(self.count, 4)
+
+        lats, lons = zipcode.zipcodes.lookup(["02139", "99999", "10001", "abc"])
+
+        self.assertAlmostEqual(lats[0], 42.3647, places=3)
+        self.assertAlmostEqual(lons[2], -73.9967, places=3)
+        self.assertTrue(lats[1] != lats[1])
+        self.assertTrue(lats[3] != lats[3])
+
+    def test_location_matches(self):
+        """Only users inside the radius come back, with their distance."""
+
+        users = [
+            {"username": "brooklyn", "location": "11201"},
+            {"username": "cambridge", "location": "02139"},
+            {"username": "nowhere", "location": "99999"},
+        ]
+
+        matches = Distance.get_location_matches("10001", users, 50)
+
+        self.assertEqual([m["username"] for m in matches], ["brooklyn"])
+        self.assertAlmostEqual(matches[0]["distance"], 3.8, delta=0.5)
+
+        matches = Distance.get_location_matches("10001", users, 500)
+        self.assertEqual(len(matches), 2)
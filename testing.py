@@ -0,0 +1,99 @@
+"""Shared setup for tests that use the database or the zipcode table."""
+
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask
+
+import zipcode
+from app import create_app
+from models import db, connect_db
+from zipcode import ZipcodeTable, build_zipcode_table
+
+GEONAMES_ROWS = [
+    "US\t10001\tNew York\tNew York\tNY\tNew York\t061\t\t\t40.7484\t-73.9967\t4",
+    "US\t11201\tBrooklyn\tNew York\tNY\tKings\t047\t\t\t40.6944\t-73.9906\t4",
+    "US\t02139\tCambridge\tMassachusetts\tMA\tMiddlesex\t017\t\t\t42.3647\t-71.1042\t4",
+    "US\t94103\tSan Francisco\tCalifornia\tCA\tSan Francisco\t075\t\t\t37.7725\t-122.4147\t4",
+]
+
+
+def make_app(**config):
+    """Return a Flask app on an in-memory SQLite database; `config`
+    overrides or adds settings."""
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite://"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(config)
+    connect_db(app)
+
+    return app
+
+
+def make_api_app(**config):
+    """Return the friender app on an in-memory SQLite database, for testing
+    routes; `config` overrides or adds settings."""
+
+    return create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite://",
+        "SECRET_KEY": "itsasecret",
+        "S3_BUCKET": "friender-test",
+        "BCRYPT_LOG_ROUNDS": 4,
+        "PASSWORD_HASH_WORKERS": 0,
+        **config,
+    })
+
+
+class DatabaseTestCase(TestCase):
+    """Runs each test in an app context with freshly created tables.
+    Set `app` to use an app other than a plain make_app() one."""
+
+    app = None
+    detached = False
+
+    def setUp(self):
+        if self.app is None:
+            type(self).app = make_app()
+
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def detach(self):
+        """Pop the test's app context until tearDown, so that each request
+        the test makes gets its own app context, `g` and session, as it
+        would when served. Call at the end of setUp."""
+
+        self.ctx.pop()
+        self.detached = True
+
+    def tearDown(self):
+        if self.detached:
+            self.ctx.push()
+
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+
+def use_test_zipcodes(test):
+    """Point zipcode lookups at a small table built from GEONAMES_ROWS
+    until `test` finishes. Returns the number of zipcodes in it."""
+
+    tmpdir = tempfile.TemporaryDirectory()
+    test.addCleanup(tmpdir.cleanup)
+
+    source = os.path.join(tmpdir.name, "US.txt")
+    dest = os.path.join(tmpdir.name, "zipcodes.npy")
+
+    with open(source, "w") as file:
+        file.write("\n".join(GEONAMES_ROWS) + "\n")
+
+    count = build_zipcode_table(source, dest)
+
+    test.addCleanup(setattr, zipcode, "zipcodes", zipcode.zipcodes)
+    zipcode.zipcodes = ZipcodeTable(dest)
+
+    return count
@@ -0,0 +1,116 @@
+"""Resized renditions (variants) of uploaded photos.
+
+After a photo is recorded, VariantPipeline renders a thumbnail, medium and
+full size JPEG (and optionally WebP) on a thread pool, stores them next to
+the original in S3 as <key>_<name>.<ext> and records an ImageVariant row for
+each. Photos that never got variants (e.g. the process died) are picked up
+again by `flask render-variants`.
+"""
+
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from models import db, Images, ImageVariant
+
+logger = logging.getLogger(__name__)
+
+# name -> longest edge in pixels
+VARIANT_SIZES = {
+    "thumbnail": 200,
+    "medium": 800,
+    "full": 1600,
+}
+
+FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+}
+
+
+def render_variants(data, webp=False):
+    """Render every variant of the image bytes `data`.
+    Returns [(name, format, width, height, bytes), ...]. Images are never
+    scaled up, so small originals give same-sized variants."""
+
+    with Image.open(io.BytesIO(data)) as original:
+        original = ImageOps.exif_transpose(original).convert("RGB")
+
+    formats = ["jpeg", "webp"] if webp else ["jpeg"]
+    rendered = []
+
+    # largest first, each one shrunk from the previous: cheaper and sharp enough
+    image = original
+    for name, size in sorted(VARIANT_SIZES.items(), key=lambda item: -item[1]):
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+
+        for format in formats:
+            pil_format, _, options = FORMATS[format]
+            buffer = io.BytesIO()
+            image.save(buffer, pil_format, **options)
+            rendered.append((name, format, image.width, image.height, buffer.getvalue()))
+
+    return rendered
+
+
+def create_variants(s3, bucket, location, image, webp=False):
+    """Render, upload and record the variants of an Images row."""
+
+    data = s3.get_object(Bucket=bucket, Key=image.filename)["Body"].read()
+
+    for name, format, width, height, body in render_variants(data, webp):
+        key = f"{image.filename}_{name}.{format}"
+
+        s3.put_object(Body=body, Bucket=bucket, Key=key,
+                      ContentType=FORMATS[format][1])
+
+        db.session.add(ImageVariant(
+            image_id=image.id,
+            name=name,
+            format=format,
+            width=width,
+            height=height,
+            filename=key,
+            path=f"{location}{key}",
+        ))
+
+    db.session.commit()
+
+
+class VariantPipeline():
+    """Background thread pool rendering variants after upload."""
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._pool = None
+
+    def submit(self, app, s3, image_id):
+        """Queue variant creation for an image; returns a Future."""
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="variants")
+
+        return self._pool.submit(self._process, app, s3, image_id)
+
+    def _process(self, app, s3, image_id):
+        with app.app_context():
+            try:
+                image = Images.query.get(image_id)
+                if image is None or image.variants:
+                    return
+
+                create_variants(s3, app.config['S3_BUCKET'], app.config['S3_LOCATION'],
+                                image, app.config['IMAGE_VARIANTS_WEBP'])
+            except Exception:
+                db.session.rollback()
+                logger.exception("rendering variants of image %s failed", image_id)
+            finally:
+                db.session.remove()
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
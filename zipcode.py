@@ -1,24 +1,188 @@
-import pgeocode
-import ssl
+"""Zipcode geocoding and distance matching for Friender.
 
-ssl._create_default_https_context = ssl._create_unverified_context
+Zipcode centroids come from a compact table built once from a local GeoNames
+postal code dump (https://download.geonames.org/export/zip/US.zip):
 
-nomi = pgeocode.Nominatim('us')
-dist = pgeocode.GeoDistance('us')
+    python zipcode.py US.txt
+
+The table is a sorted NumPy array saved to disk and memory-mapped read-only,
+so every worker process shares the same pages and nothing is downloaded at
+import or request time.
+"""
+
+import math
+import os
+import sys
+
+import numpy as np
+
+from metrics import external_seconds
 
 MI_TO_KM = 1.60934
 KM_TO_MI = 0.621371
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = 111.195
+
+ZIPCODE_TABLE = os.environ.get(
+    "ZIPCODE_TABLE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "zipcodes.npy"))
+
+TABLE_DTYPE = np.dtype([("zip", "<u4"), ("lat", "<f4"), ("lon", "<f4")])
+
+
+def zipcodes_to_ints(zipcodes):
+    """Convert zipcode strings ("02139", "02139-4307") to integer keys.
+    Anything that is not a 5 digit zipcode becomes -1."""
+
+    return np.array(
+        [int(code[:5]) if code[:5].isdigit() and len(code[:5]) == 5 else -1
+         for code in map(str, zipcodes)],
+        dtype=np.int64)
+
+
+def build_zipcode_table(source, dest=ZIPCODE_TABLE):
+    """Build the centroid table from a tab separated GeoNames postal code file
+    (country, postal code, place, ..., latitude, longitude, accuracy).
+    Duplicate zipcodes are averaged. Returns the number of zipcodes written."""
+
+    coords = {}
+
+    with open(source, encoding="utf-8") as file:
+        for line in file:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 11 or not fields[9] or not fields[10]:
+                continue
+
+            [code] = zipcodes_to_ints([fields[1]])
+            if code < 0:
+                continue
+
+            coords.setdefault(code, []).append(
+                (float(fields[9]), float(fields[10])))
+
+    table = np.empty(len(coords), dtype=TABLE_DTYPE)
+    for i, code in enumerate(sorted(coords)):
+        lat, lon = np.mean(coords[code], axis=0)
+        table[i] = (code, lat, lon)
+
+    # write next to the destination and swap it in, so running workers keep
+    # their mapping of the old file instead of reading a half written one
+    tmp = f"{dest}.tmp.npy"
+    np.save(tmp, table)
+    os.replace(tmp, dest)
+
+    return len(table)
+
+
+class ZipcodeTable():
+    """Read-only zipcode -> (lat, lon) lookup over a memory-mapped table.
+    The file is only opened on first lookup."""
+
+    def __init__(self, path=ZIPCODE_TABLE):
+        self.path = path
+        self._table = None
+
+    @property
+    def table(self):
+        if self._table is None:
+            try:
+                self._table = np.load(self.path, mmap_mode="r")
+            except FileNotFoundError:
+                raise FileNotFoundError(
+                    f"Zipcode table {self.path} not found, "
+                    "build it with: python zipcode.py US.txt")
+        return self._table
+
+    def lookup(self, zipcodes):
+        """given a list of zipcodes return (latitudes, longitudes) arrays
+        in the same order. Unknown zipcodes come back as NaN."""
+
+        keys = zipcodes_to_ints(zipcodes)
+        table_zips = self.table["zip"]
+
+        if not len(table_zips):
+            return np.full(len(keys), np.nan), np.full(len(keys), np.nan)
+
+        idx = np.minimum(np.searchsorted(table_zips, keys), len(table_zips) - 1)
+        found = table_zips[idx] == keys
+
+        lats = np.where(found, self.table["lat"][idx], np.nan)
+        lons = np.where(found, self.table["lon"][idx], np.nan)
+
+        return lats.astype(float), lons.astype(float)
+
+
+zipcodes = ZipcodeTable()
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between points given in degrees.
+    Works on scalars and NumPy arrays alike; NaN coordinates give NaN."""
+
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def bounding_box(lat, lon, max_distance):
+    """Return (min_lat, max_lat, min_lon, max_lon) in degrees enclosing every
+    point within `max_distance` miles of (lat, lon). Longitudes are not
+    wrapped, so near the antimeridian they can fall outside [-180, 180]."""
+
+    max_kilos = max_distance * MI_TO_KM
+    dlat = max_kilos / KM_PER_DEGREE
+
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90)))
+    if cos_lat < 1e-6:
+        dlon = 180
+    else:
+        dlon = min(max_kilos / (KM_PER_DEGREE * cos_lat), 180)
+
+    return max(lat - dlat, -90), min(lat + dlat, 90), lon - dlon, lon + dlon
 
 
 class Distance():
 
+    @classmethod
+    def get_coordinates(cls, zipcodes_list):
+        """given a list of zipcodes return (latitudes, longitudes) arrays
+        in the same order, resolved with a single lookup.
+        Unknown zipcodes come back as NaN."""
+
+        with external_seconds.time(service="zipcode", operation="lookup"):
+            return zipcodes.lookup(zipcodes_list)
+
     @classmethod
     def get_location_matches(cls, location, users, max_distance):
         """given a location and list of potental matches with user max distance
-        return a list of zipcodes that match the criteria.
+        return the matches within that distance, each with a "distance" key
+        in miles.
         ZIPCODES MUST BE IN STRING FORMAT."""
 
+        if not users:
+            return []
+
+        lats, lons = cls.get_coordinates(
+            [location] + [user["location"] for user in users])
+
+        distances = haversine(lats[0], lons[0], lats[1:], lons[1:])
+
+        # NaN distances (unknown zipcodes) compare False and drop out here
         max_kilos = int(max_distance) * MI_TO_KM
-        matches = [match for match in users if (dist.query_postal_code(location, match["location"])) <= max_kilos]
+        within = np.flatnonzero(distances <= max_kilos)
+
+        return [
+            {**users[i], "distance": round(float(distances[i]) * KM_TO_MI, 2)}
+            for i in within
+        ]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        sys.exit("usage: python zipcode.py GEONAMES_US_TXT [TABLE_PATH]")
 
-        return matches
+    count = build_zipcode_table(*sys.argv[1:])
+    print(f"wrote {count} zipcodes to {sys.argv[2] if len(sys.argv) == 3 else ZIPCODE_TABLE}")